@@ -1,13 +1,20 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-import shutil
+from typing import Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 from datetime import datetime
 import logging
-import json
-from .video_analyzer_v2 import VideoAnalyzer
+import orjson
+import os
+import tempfile
+import threading
+from .video_analyzer_v2 import VideoAnalyzer, POSE_MODEL_ID, image_pending, wait_for_image
 
 # Configure logging
 logging.basicConfig(
@@ -16,7 +23,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="InsideMotion API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up the analyzer in the background so startup is not blocked on model loading
+    threading.Thread(target=get_video_analyzer, name="analyzer-warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="InsideMotion API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,11 +43,39 @@ app.add_middleware(
 # Upload directory
 UPLOAD_DIR = Path(__file__).parent.parent.parent.parent / "data" / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-logger.info(f"Upload directory: {UPLOAD_DIR.absolute()}")
+UPLOAD_DIR_STR = str(UPLOAD_DIR.resolve())
+logger.info(f"Upload directory: {UPLOAD_DIR_STR}")
+
+# Read uploads in 64 KiB chunks
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Largest accepted upload
+MAX_UPLOAD_SIZE = 200 * 1024 * 1024  # 200MB in bytes
+
+# Recent analyses keyed by (model, upload SHA-256), so identical re-uploads skip analysis
+ANALYSIS_CACHE_SIZE = 32
+_analysis_cache: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
 
-# Initialize video analyzer
-video_analyzer = VideoAnalyzer()
-logger.info("VideoAnalyzer initialized")
+# Analyses run in worker threads, each with its own pose landmarker; bound how many run at once
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "1"))
+_analysis_semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+
+# Analyses that outlive their request (SSE client gone) are kept referenced until done
+_background_analyses = set()
+
+# Video analyzer is created lazily (model download + graph init is slow)
+_video_analyzer: Optional[VideoAnalyzer] = None
+_video_analyzer_lock = threading.Lock()
+
+
+def get_video_analyzer() -> VideoAnalyzer:
+    """Return the shared VideoAnalyzer, creating it on first use"""
+    global _video_analyzer
+    with _video_analyzer_lock:
+        if _video_analyzer is None:
+            _video_analyzer = VideoAnalyzer()
+            logger.info("VideoAnalyzer initialized")
+    return _video_analyzer
 
 # Frontend static files
 FRONTEND_DIR = Path(__file__).parent.parent.parent / "frontend"
@@ -43,50 +85,53 @@ logger.info(f"Frontend directory: {FRONTEND_DIR.absolute()}")
 app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
 
 
+# Frontend HTML pages are small; read them once at startup and serve from memory
+FRONTEND_PAGES = ("index.html", "result.html", "blog.html", "blog-acl.html", "blog-stoic.html")
+_page_cache = {
+    name: (FRONTEND_DIR / name).read_bytes()
+    for name in FRONTEND_PAGES
+    if (FRONTEND_DIR / name).exists()
+}
+logger.info(f"Cached {len(_page_cache)} frontend pages")
+
+
+def _serve_page(name: str, not_found_detail: str) -> HTMLResponse:
+    """Serve a cached frontend HTML page"""
+    body = _page_cache.get(name)
+    if body is None:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    return HTMLResponse(content=body)
+
+
 # Serve frontend HTML pages
 @app.get("/", response_class=HTMLResponse)
 def serve_index():
     """Serve the main upload page"""
-    index_path = FRONTEND_DIR / "index.html"
-    if not index_path.exists():
-        raise HTTPException(status_code=404, detail="Frontend not found")
-    return FileResponse(index_path)
+    return _serve_page("index.html", "Frontend not found")
 
 
 @app.get("/result.html", response_class=HTMLResponse)
 def serve_result():
     """Serve the result page"""
-    result_path = FRONTEND_DIR / "result.html"
-    if not result_path.exists():
-        raise HTTPException(status_code=404, detail="Result page not found")
-    return FileResponse(result_path)
+    return _serve_page("result.html", "Result page not found")
 
 
 @app.get("/blog.html", response_class=HTMLResponse)
 def serve_blog():
     """Serve the blog index page"""
-    blog_path = FRONTEND_DIR / "blog.html"
-    if not blog_path.exists():
-        raise HTTPException(status_code=404, detail="Blog page not found")
-    return FileResponse(blog_path)
+    return _serve_page("blog.html", "Blog page not found")
 
 
 @app.get("/blog-acl.html", response_class=HTMLResponse)
 def serve_blog_acl():
     """Serve the ACL blog article"""
-    blog_acl_path = FRONTEND_DIR / "blog-acl.html"
-    if not blog_acl_path.exists():
-        raise HTTPException(status_code=404, detail="Blog article not found")
-    return FileResponse(blog_acl_path)
+    return _serve_page("blog-acl.html", "Blog article not found")
 
 
 @app.get("/blog-stoic.html", response_class=HTMLResponse)
 def serve_blog_stoic():
     """Serve the Stoic blog article"""
-    blog_stoic_path = FRONTEND_DIR / "blog-stoic.html"
-    if not blog_stoic_path.exists():
-        raise HTTPException(status_code=404, detail="Blog article not found")
-    return FileResponse(blog_stoic_path)
+    return _serve_page("blog-stoic.html", "Blog article not found")
 
 
 @app.get("/health")
@@ -95,122 +140,100 @@ def health_check() -> dict:
     return {"status": "ok"}
 
 
-@app.get("/video/{filename}")
-async def get_video(filename: str):
-    """Serve uploaded video files"""
-    logger.info(f"Video request for: {filename}")
+def _upload_file_response(filename: str, media_type: str, not_found_detail: str) -> FileResponse:
+    """Build a FileResponse for a file in UPLOAD_DIR, reusing a single stat() call"""
+    # Only plain file names inside UPLOAD_DIR may be served
+    if "/" in filename or "\\" in filename or filename.startswith("."):
+        logger.error(f"Rejected file name: {filename}")
+        raise HTTPException(status_code=400, detail="Invalid file name")
     
-    file_path = UPLOAD_DIR / filename
+    file_path = os.path.join(UPLOAD_DIR_STR, filename)
     
-    if not file_path.exists():
-        logger.error(f"Video not found: {filename}")
-        raise HTTPException(status_code=404, detail="Video not found")
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        logger.error(f"{not_found_detail}: {filename}")
+        raise HTTPException(status_code=404, detail=not_found_detail)
     
-    logger.info(f"Serving video: {filename}")
     return FileResponse(
         path=file_path,
-        media_type="video/mp4",
-        filename=filename
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result
     )
 
 
+@app.get("/video/{filename}")
+async def get_video(filename: str):
+    """Serve uploaded video files"""
+    logger.info(f"Video request for: {filename}")
+    response = _upload_file_response(filename, "video/mp4", "Video not found")
+    logger.info(f"Serving video: {filename}")
+    return response
+
+
 @app.get("/keypoints/{filename}")
 async def get_keypoints(filename: str):
-    """Serve keypoints JSON files"""
+    """Serve keypoints files: NDJSON (one columnar chunk of frames per line) or binary .npz"""
     logger.info(f"Keypoints request for: {filename}")
-    
-    file_path = UPLOAD_DIR / filename
-    
-    if not file_path.exists():
-        logger.error(f"Keypoints file not found: {filename}")
-        raise HTTPException(status_code=404, detail="Keypoints file not found")
-    
+    media_type = "application/octet-stream" if filename.endswith(".npz") else "application/x-ndjson"
+    response = _upload_file_response(filename, media_type, "Keypoints file not found")
     logger.info(f"Serving keypoints: {filename}")
-    return FileResponse(
-        path=file_path,
-        media_type="application/json",
-        filename=filename
-    )
+    return response
 
 
 @app.get("/image/{filename}")
 async def get_image(filename: str):
     """Serve key moment PNG images"""
     logger.info(f"Image request for: {filename}")
-    
-    file_path = UPLOAD_DIR / filename
-    
-    if not file_path.exists():
-        logger.error(f"Image not found: {filename}")
+    # Key moments are encoded in the background; wait if this one is not written yet
+    try:
+        await asyncio.to_thread(wait_for_image, filename, 30)
+    except TimeoutError:
+        logger.error(f"Image still encoding after 30s: {filename}")
+        raise HTTPException(status_code=503, detail="Image not ready yet")
+    except Exception as e:
+        logger.error(f"Failed to encode image {filename}: {e}")
         raise HTTPException(status_code=404, detail="Image not found")
-    
+    response = _upload_file_response(filename, "image/png", "Image not found")
     logger.info(f"Serving image: {filename}")
-    return FileResponse(
-        path=file_path,
-        media_type="image/png",
-        filename=filename
-    )
+    return response
 
 
-@app.post("/upload")
-async def upload_video(file: UploadFile = File(...)) -> dict:
-    logger.info(f"=== UPLOAD REQUEST RECEIVED ===")
-    logger.info(f"Filename: {file.filename}")
-    logger.info(f"Content-Type: {file.content_type}")
+def _open_upload_tmp() -> Tuple[int, Optional[str]]:
+    """Open an unnamed temp file in UPLOAD_DIR (Linux O_TMPFILE), or a named .part file as fallback"""
+    if hasattr(os, "O_TMPFILE"):
+        try:
+            return os.open(UPLOAD_DIR, os.O_TMPFILE | os.O_WRONLY, 0o644), None
+        except OSError:
+            pass
     
-    # Validate content type
-    if not file.content_type or not file.content_type.startswith("video/"):
-        logger.error(f"Invalid content type: {file.content_type}")
-        raise HTTPException(status_code=400, detail="Only video files are allowed")
-    
-    logger.info("Content type validation passed")
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    return fd, tmp_path
 
-    # Read file content
-    logger.info("Reading file content...")
-    content = await file.read()
-    file_size = len(content)
-    logger.info(f"File size: {file_size} bytes ({file_size / (1024*1024):.2f} MB)")
-    
-    if file_size == 0:
-        logger.error("Empty file received")
-        raise HTTPException(status_code=400, detail="Empty file")
-    
-    # Check file size (200MB max)
-    max_size = 200 * 1024 * 1024  # 200MB in bytes
-    if file_size > max_size:
-        logger.error(f"File too large: {file_size} bytes > {max_size} bytes")
-        raise HTTPException(status_code=400, detail="File too large (max 200MB)")
-    
-    logger.info("File size validation passed")
 
-    # Save file with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_filename = f"{timestamp}_{file.filename}"
-    file_path = UPLOAD_DIR / safe_filename
-    
-    logger.info(f"Saving file to: {file_path}")
-    
-    try:
-        with open(file_path, "wb") as f:
-            f.write(content)
-        logger.info(f"✓ File saved successfully: {safe_filename}")
-    except Exception as e:
-        logger.error(f"Failed to save file: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+def _publish_upload(f, tmp_path: Optional[str], file_path: Path):
+    """Give a fully written temp upload file its final name"""
+    f.flush()
+    if tmp_path is None:
+        # Link the anonymous O_TMPFILE into the directory. Passing src_dir_fd makes
+        # CPython use linkat(AT_SYMLINK_FOLLOW) so the /proc magic link is resolved
+        # (the fd itself is ignored because the source path is absolute).
+        file_path.unlink(missing_ok=True)
+        os.link(f"/proc/self/fd/{f.fileno()}", file_path, src_dir_fd=f.fileno(), follow_symlinks=True)
+    else:
+        os.replace(tmp_path, file_path)
+
 
-    # Run AI analysis with MediaPipe
+def _analyze_upload(file_path: Path, on_chunk: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Run AI analysis with MediaPipe, falling back to demo analysis on failure"""
     logger.info("Starting AI video analysis...")
-    key_moments = []
     try:
-        analysis_data = video_analyzer.analyze_video(file_path)
+        # Keypoints are streamed to an NDJSON file in chunks during analysis
+        keypoints_file = file_path.with_suffix('.keypoints.ndjson')
+        analysis_data = get_video_analyzer().analyze_video(file_path, keypoints_file, on_chunk)
         analysis_result = analysis_data["analysis"]
-        keypoints_data = analysis_data["keypoints_data"]
         key_moments = analysis_data.get("key_moments", [])
-        
-        # Save keypoints to JSON file
-        keypoints_file = file_path.with_suffix('.keypoints.json')
-        with open(keypoints_file, 'w') as f:
-            json.dump(keypoints_data, f)
         logger.info(f"✓ Keypoints saved to: {keypoints_file.name}")
         
         logger.info(f"✓ Analysis complete: {analysis_result}")
@@ -228,7 +251,112 @@ async def upload_video(file: UploadFile = File(...)) -> dict:
         }
         keypoints_file = None
         key_moments = []
+    
+    return {
+        "analysis": analysis_result,
+        "keypoints_file": keypoints_file.name if keypoints_file else None,
+        "keypoints_npz_file": keypoints_file.with_suffix('.npz').name if keypoints_file else None,
+        "key_moments": key_moments
+    }
 
+
+async def _save_upload(file: UploadFile) -> Tuple[str, Path, int, str]:
+    """Validate and store an uploaded video, returning (saved name, path, size, sha256)"""
+    logger.info(f"=== UPLOAD REQUEST RECEIVED ===")
+    logger.info(f"Filename: {file.filename}")
+    logger.info(f"Content-Type: {file.content_type}")
+    
+    # Validate content type
+    if not file.content_type or not file.content_type.startswith("video/"):
+        logger.error(f"Invalid content type: {file.content_type}")
+        raise HTTPException(status_code=400, detail="Only video files are allowed")
+    
+    logger.info("Content type validation passed")
+
+    # Save file with timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_filename = f"{timestamp}_{file.filename}"
+    file_path = UPLOAD_DIR / safe_filename
+    
+    logger.info(f"Saving file to: {file_path}")
+    
+    # Stream upload to disk in chunks instead of buffering the whole file in memory.
+    # Data goes to a temp file that only gets its final name once fully written,
+    # so failed or rejected uploads never leave a partial file behind.
+    max_size = MAX_UPLOAD_SIZE
+    file_size = 0
+    hasher = hashlib.sha256()
+    fd, tmp_path = _open_upload_tmp()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > max_size:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
+            
+            if 0 < file_size <= max_size:
+                _publish_upload(f, tmp_path, file_path)
+    except Exception as e:
+        logger.error(f"Failed to save file: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    
+    logger.info(f"File size: {file_size} bytes ({file_size / (1024*1024):.2f} MB)")
+    
+    if file_size == 0:
+        logger.error("Empty file received")
+        raise HTTPException(status_code=400, detail="Empty file")
+    
+    if file_size > max_size:
+        logger.error(f"File too large: more than {max_size} bytes")
+        raise HTTPException(status_code=413, detail="File too large (max 200MB)")
+    
+    logger.info("File size validation passed")
+    logger.info(f"✓ File saved successfully: {safe_filename}")
+    
+    return safe_filename, file_path, file_size, hasher.hexdigest()
+
+
+def _get_cached_analysis(cache_key: Tuple[str, str]) -> Optional[Dict]:
+    """Return the analysis of an identical earlier upload if all its files still exist"""
+    result = _analysis_cache.get(cache_key)
+    if result is None:
+        return None
+    
+    # Keypoints files and every key-moment image the result links to (images
+    # may still be encoding in the background, which counts as present)
+    names = [result["keypoints_file"], result["keypoints_npz_file"]]
+    images = [moment["image"] for moment in result["key_moments"]]
+    if all(os.path.exists(os.path.join(UPLOAD_DIR_STR, name)) for name in names) and all(
+        image_pending(name) or os.path.exists(os.path.join(UPLOAD_DIR_STR, name)) for name in images
+    ):
+        _analysis_cache.move_to_end(cache_key)
+        logger.info(f"✓ Reusing cached analysis (sha256 {cache_key[1][:12]})")
+        return result
+    
+    logger.info(f"Dropping cached analysis with missing files (sha256 {cache_key[1][:12]})")
+    del _analysis_cache[cache_key]
+    return None
+
+
+def _cache_analysis(cache_key: Tuple[str, str], result: Dict):
+    """Remember a successful analysis, evicting the least recently used one"""
+    if result["keypoints_file"]:
+        _analysis_cache[cache_key] = result
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+
+def _upload_response(file: UploadFile, safe_filename: str, file_path: Path, file_size: int, result: Dict) -> Dict:
+    """Build the upload response returned to the frontend"""
+    key_moments = result["key_moments"]
     response = {
         "filename": file.filename,
         "saved_as": safe_filename,
@@ -236,12 +364,84 @@ async def upload_video(file: UploadFile = File(...)) -> dict:
         "size_bytes": file_size,
         "status": "uploaded",
         "file_path": str(file_path),
-        "keypoints_file": keypoints_file.name if keypoints_file else None,
-        "analysis": analysis_result,
+        "keypoints_file": result["keypoints_file"],
+        "keypoints_npz_file": result["keypoints_npz_file"],
+        "analysis": result["analysis"],
         "key_moments": key_moments
     }
     
-    logger.info(f"=== UPLOAD COMPLETE ===")
-    logger.info(f"Response: {response}")
+    logger.info("=== UPLOAD COMPLETE ===")
+    logger.info("Upload complete: saved_as=%s size=%d key_moments=%d", safe_filename, file_size, len(key_moments))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Full response: %s", response)
     
     return response
+
+
+async def _run_analysis(cache_key: Tuple[str, str], file_path: Path,
+                        on_chunk: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Analyze an upload within the concurrency limit and cache the result"""
+    # Run the blocking analysis off the event loop so other requests stay responsive
+    async with _analysis_semaphore:
+        result = await asyncio.to_thread(_analyze_upload, file_path, on_chunk)
+    _cache_analysis(cache_key, result)
+    return result
+
+
+@app.post("/upload")
+async def upload_video(file: UploadFile = File(...)) -> dict:
+    safe_filename, file_path, file_size, digest = await _save_upload(file)
+    
+    # Reuse the analysis of an identical earlier upload if its files still exist
+    cache_key = (POSE_MODEL_ID, digest)
+    result = _get_cached_analysis(cache_key)
+    if result is None:
+        result = await _run_analysis(cache_key, file_path)
+    
+    return _upload_response(file, safe_filename, file_path, file_size, result)
+
+
+def _sse_event(event: str, data) -> bytes:
+    """Encode one Server-Sent Event"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
+
+
+async def _analysis_event_stream(file: UploadFile, safe_filename: str, file_path: Path, file_size: int, digest: str):
+    """Yield keypoint chunks as the analyzer produces them, then the full upload response"""
+    cache_key = (POSE_MODEL_ID, digest)
+    result = _get_cached_analysis(cache_key)
+    
+    if result is None:
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        
+        def on_chunk(chunk):
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        
+        # The analysis runs as its own task: if the client disconnects, it still
+        # holds its semaphore slot until the worker thread finishes, and its
+        # result is cached for the next identical upload
+        task = asyncio.ensure_future(_run_analysis(cache_key, file_path, on_chunk))
+        _background_analyses.add(task)
+        task.add_done_callback(_background_analyses.discard)
+        task.add_done_callback(lambda _: chunks.put_nowait(None))
+        
+        while (chunk := await chunks.get()) is not None:
+            yield _sse_event("chunk", chunk)
+        result = await asyncio.shield(task)
+    
+    yield _sse_event("summary", _upload_response(file, safe_filename, file_path, file_size, result))
+
+
+@app.post("/upload/stream")
+async def upload_video_stream(file: UploadFile = File(...)) -> StreamingResponse:
+    """Upload a video and stream analysis progress as Server-Sent Events
+    
+    Emits a "chunk" event per batch of analyzed frames and a final "summary"
+    event carrying the same payload as POST /upload.
+    """
+    safe_filename, file_path, file_size, digest = await _save_upload(file)
+    return StreamingResponse(
+        _analysis_event_stream(file, safe_filename, file_path, file_size, digest),
+        media_type="text/event-stream"
+    )
@@ -7,12 +7,28 @@ import cv2
 import numpy as np
 from pathlib import Path
 import logging
-from typing import List, Dict, Optional
+import functools
+import hashlib
+import itertools
+import math
+from typing import Callable, List, Dict, Optional
 import urllib.request
 import os
+import orjson
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Number of parallel PoseLandmarker graphs per video (MediaPipe has no batch
+# inference). The default 1 keeps VIDEO mode, which tracks the pose between
+# frames instead of running person detection on every frame; videos analyzed
+# at the same time each get their own landmarker (see _get_detector_pool)
+POSE_WORKERS = max(1, int(os.getenv("POSE_WORKERS", "1")))
+
 # Try to import MediaPipe
 try:
     import mediapipe as mp
@@ -23,6 +39,24 @@ except ImportError:
     MEDIAPIPE_AVAILABLE = False
     logger.warning("MediaPipe not available, will use mock analysis")
 
+# PyAV is optional; when installed it decodes the analysis pass (see VIDEO_BACKEND)
+try:
+    import av
+    AV_AVAILABLE = True
+    try:
+        from av.codec.hwaccel import HWAccel
+    except ImportError:
+        HWAccel = None
+except ImportError:
+    AV_AVAILABLE = False
+
+# Numba is optional; without it compensation metrics are computed with NumPy
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # MediaPipe pose landmark names (33 landmarks total, we use subset)
 POSE_LANDMARKS = {
     0: "nose",
@@ -36,117 +70,541 @@ POSE_LANDMARKS = {
     28: "right_ankle"
 }
 
+# Keypoints are always stored in POSE_LANDMARKS order, so positions are fixed
+LANDMARK_INDICES = tuple(POSE_LANDMARKS.keys())
+LANDMARK_NAMES = tuple(POSE_LANDMARKS.values())
+NAME_TO_IDX = {name: i for i, name in enumerate(LANDMARK_NAMES)}
+L_SHOULDER, R_SHOULDER = NAME_TO_IDX["left_shoulder"], NAME_TO_IDX["right_shoulder"]
+L_HIP, R_HIP = NAME_TO_IDX["left_hip"], NAME_TO_IDX["right_hip"]
+L_KNEE, R_KNEE = NAME_TO_IDX["left_knee"], NAME_TO_IDX["right_knee"]
+L_ANKLE, R_ANKLE = NAME_TO_IDX["left_ankle"], NAME_TO_IDX["right_ankle"]
+
+# Skeleton drawn on key moments: (start, end, side) index pairs into LANDMARK_NAMES
+SKELETON_CONNECTIONS = (
+    (L_SHOULDER, L_HIP, "left"),
+    (L_HIP, L_KNEE, "left"),
+    (L_KNEE, L_ANKLE, "left"),
+    (R_SHOULDER, R_HIP, "right"),
+    (R_HIP, R_KNEE, "right"),
+    (R_KNEE, R_ANKLE, "right"),
+    (L_HIP, R_HIP, "center")
+)
+LANDMARK_SIDES = tuple(
+    "left" if "left" in name else "right" if "right" in name else "center"
+    for name in LANDMARK_NAMES
+)
+
+# Per-landmark fields in the (frames, landmarks, fields) keypoints array
+KP_X, KP_Y, KP_Z, KP_VISIBILITY = 0, 1, 2, 3
+
+# Landmarks the compensation metrics are computed from; frames where any of
+# them is less visible than MIN_VISIBILITY (occluded or out of frame) are skipped
+COMPENSATION_LANDMARKS = [L_HIP, R_HIP, L_KNEE, R_KNEE, L_ANKLE, R_ANKLE]
+MIN_VISIBILITY = 0.5
+
+# Model complexity, same scale as the legacy Pose solution:
+# 0 = lite (fastest, default), 1 = full, 2 = heavy (most accurate)
+POSE_MODEL_VARIANTS = {0: "lite", 1: "full", 2: "heavy"}
+POSE_COMPLEXITY = int(os.getenv("POSE_COMPLEXITY", "0"))
+POSE_MODEL_NAME = f"pose_landmarker_{POSE_MODEL_VARIANTS[POSE_COMPLEXITY]}"
+
 # Model URL
-POSE_LANDMARKER_MODEL_URL = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/1/pose_landmarker_lite.task"
+POSE_LANDMARKER_MODEL_URL = f"https://storage.googleapis.com/mediapipe-models/pose_landmarker/{POSE_MODEL_NAME}/float16/1/{POSE_MODEL_NAME}.task"
+
+# Expected SHA-256 of the downloaded model; if unset, the hash recorded next to
+# the model (<model>.sha256) when it was downloaded is checked instead, and a
+# model with neither must be an intact .task bundle (see _is_model_bundle)
+POSE_MODEL_SHA256 = os.getenv("POSE_MODEL_SHA256", "").lower()
+
+# Optional local .task model used instead of the float16 download (e.g. an
+# int8-quantized landmarker); the float16 model stays the fallback if it fails to load
+POSE_MODEL_PATH = os.getenv("POSE_MODEL_PATH", "")
+
+# Where the model is downloaded to: a per-user cache shared by every worker and
+# install. A model placed next to this module (as the Docker image and the
+# deployment guide do) is used first, so offline containers never download
+POSE_MODEL_DIR = Path(
+    os.getenv("POSE_MODEL_DIR")
+    or Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "rehab-motion-ai"
+)
+
+# Identifies the model that produced an analysis (used to key cached results)
+POSE_MODEL_ID = POSE_MODEL_PATH or POSE_LANDMARKER_MODEL_URL
+
+# Inference delegate: "cpu" (default) or "gpu" (falls back to CPU if unavailable)
+POSE_DELEGATE = os.getenv("POSE_DELEGATE", "cpu").lower()
+
+# Ask FFmpeg for hardware video decoding (NVDEC, VAAPI, ...) when available
+VIDEO_HW_DECODE = os.getenv("VIDEO_HW_DECODE", "1") == "1"
+
+# GPU used for hardware decoding on multi-GPU hosts (-1 = let FFmpeg choose)
+VIDEO_HW_DEVICE = int(os.getenv("VIDEO_HW_DEVICE", "-1"))
+
+# Decoder for the analysis pass: "auto" (PyAV if installed, else OpenCV), "av" or
+# "opencv". PyAV scales and converts to RGB in one swscale pass; key moments
+# are always read with OpenCV
+VIDEO_BACKEND = os.getenv("VIDEO_BACKEND", "auto").lower()
+
+# PyAV hardware device type (cuda, vaapi, videotoolbox, ...) when VIDEO_HW_DECODE is on
+VIDEO_HWACCEL_TYPE = os.getenv("VIDEO_HWACCEL_TYPE", "cuda")
+
+# Frames per NDJSON line when streaming keypoints to disk
+KEYPOINTS_CHUNK_FRAMES = 300
+
+# Frames are downscaled to this short side before pose detection (0 = keep
+# full resolution); landmarks are normalized, so results stay comparable.
+# 480 leaves the person crop that the landmark model resizes to 256x256 close
+# to its native size, so accuracy holds while 1080p input costs ~5x less
+POSE_INPUT_SHORT_SIDE = int(os.getenv("POSE_INPUT_SHORT_SIDE", "480"))
+
+# Decoded frames buffered between the reader thread and the detector pool:
+# enough for every detector to have its next frame ready, so a slow decode
+# (e.g. a keyframe) doesn't leave the pool idle
+DECODE_QUEUE_SIZE = max(3, 2 * POSE_WORKERS)
+
+# Key moments rendered as annotated images, at fractions of the video duration:
+# neutral (early), peak compensation (middle)
+KEY_MOMENTS = [
+    {"fraction": 0.2, "label": "Neutral", "type": "neutral"},
+    {"fraction": 0.5, "label": "Compensation peak", "type": "peak"}
+]
+
+# Key moments at most this many frames apart are reached by decoding forward
+# instead of another keyframe seek (shorter than a typical GOP)
+KEY_MOMENT_GRAB_LIMIT = 60
+
+
+def _compensation_stats_numpy(kp: np.ndarray):
+    """Compensation statistics of a (frames, 9, 4) keypoints array
+    
+    Returns (avg hip shift direction, avg hip shift, max hip shift,
+    avg knee depth diff, avg knee asymmetry, max knee asymmetry).
+    """
+    # Hip shift analysis
+    # Shift direction: positive = right, negative = left
+    hip_shift_directions = (kp[:, L_HIP, KP_X] + kp[:, R_HIP, KP_X]) / 2 - 0.5
+    hip_shifts = np.abs(hip_shift_directions)
+    
+    # Knee asymmetry analysis
+    # Calculate knee flexion depth (larger value = more flexed = healthy)
+    # Distance from knee to ankle: larger = knee further from ankle = more bent
+    left_knee_flexion = np.abs(kp[:, L_KNEE, KP_Y] - kp[:, L_ANKLE, KP_Y])
+    right_knee_flexion = np.abs(kp[:, R_KNEE, KP_Y] - kp[:, R_ANKLE, KP_Y])
+    
+    # Positive = LEFT knee more flexed → LEFT healthy, RIGHT compensating
+    # Negative = RIGHT knee more flexed → RIGHT healthy, LEFT compensating
+    knee_depth_diffs = left_knee_flexion - right_knee_flexion
+    knee_asymmetries = np.abs(knee_depth_diffs)
+    
+    # Each series is reduced directly; stacking them first would only add a copy
+    return (
+        hip_shift_directions.mean(), hip_shifts.mean(), hip_shifts.max(),
+        knee_depth_diffs.mean(), knee_asymmetries.mean(), knee_asymmetries.max()
+    )
+
+
+def _compensation_stats_loop(kp: np.ndarray):
+    """Same statistics as _compensation_stats_numpy in a single pass (compiled with Numba)
+    
+    Per-frame values stay float32 like the keypoints; only the running sums are
+    float64, so long videos don't lose precision in the averages.
+    """
+    n = kp.shape[0]
+    half = np.float32(0.5)
+    sum_direction = sum_shift = sum_depth = sum_asymmetry = 0.0
+    max_shift = max_asymmetry = np.float32(0.0)
+    
+    for i in range(n):
+        direction = (kp[i, L_HIP, KP_X] + kp[i, R_HIP, KP_X]) * half - half
+        shift = abs(direction)
+        depth = abs(kp[i, L_KNEE, KP_Y] - kp[i, L_ANKLE, KP_Y]) - abs(kp[i, R_KNEE, KP_Y] - kp[i, R_ANKLE, KP_Y])
+        asymmetry = abs(depth)
+        
+        sum_direction += direction
+        sum_shift += shift
+        sum_depth += depth
+        sum_asymmetry += asymmetry
+        max_shift = max(max_shift, shift)
+        max_asymmetry = max(max_asymmetry, asymmetry)
+    
+    return sum_direction / n, sum_shift / n, max_shift, sum_depth / n, sum_asymmetry / n, max_asymmetry
+
+
+_compensation_stats = _compensation_stats_numpy
+if NUMBA_AVAILABLE:
+    # Compiled (or loaded from the on-disk cache) here with a dummy frame, so
+    # no request pays for the JIT; any compile failure keeps the NumPy version
+    try:
+        _compensation_stats_jit = njit(cache=True, fastmath=True)(_compensation_stats_loop)
+        _compensation_stats_jit(np.zeros((1, len(LANDMARK_NAMES), 4), dtype=np.float32))
+        _compensation_stats = _compensation_stats_jit
+    except Exception as e:
+        logger.warning(f"Numba compensation kernel unavailable ({e}), using NumPy")
+
+
+# Key-moment PNGs are encoded in the background so analysis can return first;
+# files still being written are tracked by name (see wait_for_image)
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=2)
+_pending_images: Dict[str, Future] = {}
+_pending_images_lock = threading.Lock()
+
+
+def _encode_png(output_path: Path, image: np.ndarray):
+    """Write a key-moment PNG (fast, light compression), executed on _ENCODE_POOL"""
+    try:
+        if not cv2.imwrite(str(output_path), image, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            logger.error("Failed to write key moment: %s", output_path.name)
+    finally:
+        with _pending_images_lock:
+            _pending_images.pop(output_path.name, None)
+
+
+def _save_png_async(output_path: Path, image: np.ndarray):
+    """Queue a key-moment PNG for background encoding"""
+    # Registered under the lock, so _encode_png cannot unregister it first
+    with _pending_images_lock:
+        _pending_images[output_path.name] = _ENCODE_POOL.submit(_encode_png, output_path, image)
+
+
+def image_pending(filename: str) -> bool:
+    """Whether a key-moment PNG is queued or still being encoded"""
+    with _pending_images_lock:
+        return filename in _pending_images
+
+
+def wait_for_image(filename: str, timeout: Optional[float] = None):
+    """Block until a key-moment PNG that is still being encoded has been written"""
+    with _pending_images_lock:
+        future = _pending_images.get(filename)
+    if future:
+        future.result(timeout)
+
+
+def _create_options(model_path: str, delegate: str, running_mode):
+    """Create PoseLandmarker options
+    
+    VIDEO mode tracks the pose between consecutive frames; IMAGE mode detects
+    it in every frame on its own.
+    """
+    base_options = python.BaseOptions(
+        model_asset_path=model_path,
+        delegate=python.BaseOptions.Delegate.GPU if delegate == "gpu" else python.BaseOptions.Delegate.CPU
+    )
+    options = dict(
+        base_options=base_options,
+        running_mode=running_mode,
+        min_pose_detection_confidence=0.5,
+        min_pose_presence_confidence=0.5
+    )
+    if running_mode == vision.RunningMode.VIDEO:
+        # Below this the pose is re-detected instead of tracked from the last
+        # frame (only VIDEO mode tracks, IMAGE mode ignores the setting)
+        options["min_tracking_confidence"] = 0.5
+    return vision.PoseLandmarkerOptions(**options)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_detector_pool(model_path: str, delegate: str, workers: int) -> Dict:
+    """Set up pose detection once per process and share it between analyzers
+    
+    With one worker the landmarker runs in VIDEO mode and tracks the pose from
+    frame to frame. That state belongs to a single video, so no landmarker is
+    kept: each video creates a fresh one from "options", on its own thread,
+    so concurrent analyses run their landmarkers in parallel.
+    With several workers frames are spread over the pool and no landmarker sees
+    consecutive frames, so they run in IMAGE mode (stateless) and are created
+    once here ("detectors").
+    
+    Returns a dict with "options", "video_mode", "detectors" and, in IMAGE
+    mode, one single-thread executor per detector (PoseLandmarker is not
+    thread-safe).
+    """
+    video_mode = workers == 1
+    running_mode = vision.RunningMode.VIDEO if video_mode else vision.RunningMode.IMAGE
+    options = _create_options(model_path, delegate, running_mode)
+    
+    try:
+        first_detector = vision.PoseLandmarker.create_from_options(options)
+    except Exception as e:
+        if delegate != "gpu":
+            raise
+        logger.warning(f"GPU delegate unavailable ({e}), falling back to CPU")
+        options = _create_options(model_path, "cpu", running_mode)
+        first_detector = vision.PoseLandmarker.create_from_options(options)
+    
+    if video_mode:
+        first_detector.close()  # Only checked that the model loads
+        detectors = []
+    else:
+        detectors = [first_detector] + [
+            vision.PoseLandmarker.create_from_options(options) for _ in range(workers - 1)
+        ]
+    return {
+        "options": options,
+        "video_mode": video_mode,
+        "detectors": detectors,
+        "workers": [ThreadPoolExecutor(max_workers=1) for _ in detectors]
+    }
+
+
+def _is_model_bundle(path: Path) -> bool:
+    """Whether path is an intact .task model bundle
+    
+    A bundle is a zip of .tflite models carrying a CRC32 per member, so an HTML
+    error page, a truncated download or a corrupted file all fail this check.
+    """
+    try:
+        with zipfile.ZipFile(path) as bundle:
+            return bundle.testzip() is None and any(name.endswith(".tflite") for name in bundle.namelist())
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def _sha256_file(path: Path) -> str:
+    """SHA-256 hex digest of a file, read in 1 MB blocks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
 
 
 class VideoAnalyzer:
+    # Set once the model file has been checked, so later instances skip hashing
+    _verified = False
+    
     def __init__(self):
+        self._pool = None  # Shared detection setup (see _get_detector_pool), None without MediaPipe
+        
         if not MEDIAPIPE_AVAILABLE:
             logger.warning("MediaPipe not available")
-            self.detector = None
             return
         
         try:
-            # Download model if not exists
-            model_path = Path(__file__).parent / "pose_landmarker_lite.task"
-            
-            if not model_path.exists():
-                logger.info(f"Downloading pose model to {model_path}...")
-                urllib.request.urlretrieve(POSE_LANDMARKER_MODEL_URL, model_path)
-                logger.info("✓ Model downloaded")
-            
-            # Create PoseLandmarker options (IMAGE mode for simpler processing)
-            base_options = python.BaseOptions(model_asset_path=str(model_path))
-            options = vision.PoseLandmarkerOptions(
-                base_options=base_options,
-                running_mode=vision.RunningMode.IMAGE,
-                min_pose_detection_confidence=0.5,
-                min_pose_presence_confidence=0.5
-            )
+            # Graphs are cached per process, so further analyzers reuse them
+            if POSE_MODEL_PATH:
+                try:
+                    self._pool = _get_detector_pool(POSE_MODEL_PATH, POSE_DELEGATE, POSE_WORKERS)
+                    logger.info(f"✓ Using pose model {POSE_MODEL_PATH}")
+                except Exception as e:
+                    logger.warning(f"Could not load pose model {POSE_MODEL_PATH} ({e}), falling back to {POSE_MODEL_NAME}")
             
-            self.detector = vision.PoseLandmarker.create_from_options(options)
-            logger.info("✓ MediaPipe Pose Landmarker initialized successfully (IMAGE mode)")
+            if self._pool is None:
+                # Download model if missing or corrupt
+                model_path = Path(__file__).parent / f"{POSE_MODEL_NAME}.task"
+                if not model_path.exists():
+                    model_path = POSE_MODEL_DIR / f"{POSE_MODEL_NAME}.task"
+                self._ensure_model(model_path)
+                
+                self._pool = _get_detector_pool(str(model_path), POSE_DELEGATE, POSE_WORKERS)
+            mode = "VIDEO" if self._pool["video_mode"] else "IMAGE"
+            logger.info(f"✓ MediaPipe Pose Landmarker initialized successfully ({mode} mode, {POSE_WORKERS} workers)")
             
         except Exception as e:
             logger.error(f"Failed to initialize MediaPipe: {e}")
-            self.detector = None
+            self._pool = None
     
-    def analyze_video(self, video_path: Path) -> Dict:
+    def _ensure_model(self, model_path: Path):
+        """Make sure model_path holds an intact model, (re)downloading it if needed
+        
+        The download goes to a .tmp file that is renamed into place only when
+        complete, so an interrupted download never leaves a truncated model.
+        A model with no hash to compare against (no POSE_MODEL_SHA256 and no
+        recorded .sha256, e.g. one baked into the image) and every fresh download
+        must also be an intact model bundle (see _is_model_bundle).
+        """
+        if VideoAnalyzer._verified:
+            return
+        
+        hash_path = model_path.parent / f"{model_path.name}.sha256"
+        expected = POSE_MODEL_SHA256 or (hash_path.read_text().strip() if hash_path.exists() else "")
+        
+        if model_path.exists():
+            if expected and _sha256_file(model_path) == expected:
+                VideoAnalyzer._verified = True
+                return
+            if not expected and _is_model_bundle(model_path):
+                VideoAnalyzer._verified = True
+                return
+            logger.warning(f"Pose model {model_path.name} failed integrity check, downloading it again")
+        
+        logger.info(f"Downloading pose model to {model_path}...")
+        model_path.parent.mkdir(parents=True, exist_ok=True)
+        # Per-process name: workers sharing the cache directory may download at once
+        tmp_path = model_path.parent / f"{model_path.name}.{os.getpid()}.tmp"
+        hasher = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(POSE_LANDMARKER_MODEL_URL) as response, open(tmp_path, "wb") as f:
+                for block in iter(lambda: response.read(1024 * 1024), b""):
+                    hasher.update(block)
+                    f.write(block)
+            
+            digest = hasher.hexdigest()
+            if POSE_MODEL_SHA256 and digest != POSE_MODEL_SHA256:
+                raise RuntimeError(f"Downloaded pose model hash {digest} does not match POSE_MODEL_SHA256")
+            if not _is_model_bundle(tmp_path):
+                raise RuntimeError("Downloaded pose model is not a valid .task bundle")
+            
+            os.replace(tmp_path, model_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        
+        hash_path.write_text(digest)
+        VideoAnalyzer._verified = True
+        logger.info("✓ Model downloaded")
+    
+    def _open_av(self, video_path: Path):
+        """Open a video with PyAV, preferring hardware decoding (falls back to software)"""
+        if VIDEO_HW_DECODE and HWAccel is not None:
+            try:
+                hwaccel = HWAccel(
+                    device_type=VIDEO_HWACCEL_TYPE,
+                    device=str(VIDEO_HW_DEVICE) if VIDEO_HW_DEVICE >= 0 else None,
+                    allow_software_fallback=True
+                )
+                return av.open(str(video_path), hwaccel=hwaccel)
+            except Exception as e:
+                logger.warning(f"Hardware decoding unavailable for {video_path.name} ({e}), using software decoder")
+        return av.open(str(video_path))
+    
+    def _open_capture(self, video_path: Path) -> cv2.VideoCapture:
+        """Open a video, preferring hardware decoding and falling back to software"""
+        if VIDEO_HW_DECODE:
+            # Decoder properties only take effect when passed at open time
+            params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+            if VIDEO_HW_DEVICE >= 0:
+                params += [cv2.CAP_PROP_HW_DEVICE, VIDEO_HW_DEVICE]
+            cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG, params)
+            if cap.isOpened():
+                return cap
+            cap.release()
+            logger.warning(f"Hardware decoding unavailable for {video_path.name}, using software decoder")
+        
+        return cv2.VideoCapture(str(video_path))
+    
+    def analyze_video(self, video_path: Path, keypoints_path: Optional[Path] = None,
+                      on_chunk: Optional[Callable[[Dict], None]] = None,
+                      render_key_moments: bool = True) -> Dict:
         """
         Analyze video and extract pose keypoints for each frame
+        
+        Keypoints are produced in chunks of up to KEYPOINTS_CHUNK_FRAMES frames
+        (see _keypoints_chunk for the layout).
+        If keypoints_path is given, each chunk is appended to it as one NDJSON line
+        and the full keypoints array is saved next to it as .npz (see
+        _save_keypoints_npz). If on_chunk is given, it is called with each chunk
+        as soon as it is ready.
+        
+        The result holds the keypoints as arrays: "frame_numbers" and the
+        (frames, 9, 4) float32 "keypoints_array".
+        
+        With render_key_moments=False no annotated images are drawn or saved
+        ("key_moments" is empty), for runs that only need the metrics.
         """
         logger.info(f"Starting video analysis: {video_path}")
         
         if not video_path.exists():
             raise FileNotFoundError(f"Video file not found: {video_path}")
         
-        if not self.detector:
+        if self._pool is None:
             logger.warning("MediaPipe not available, returning mock data")
-            return self._generate_mock_analysis()
+            return self._generate_mock_analysis(keypoints_path, on_chunk)
         
-        cap = cv2.VideoCapture(str(video_path))
+        if keypoints_path:
+            keypoints_path.write_bytes(b"")
         
-        if not cap.isOpened():
-            raise RuntimeError(f"Failed to open video: {video_path}")
+        container = None
+        if AV_AVAILABLE and VIDEO_BACKEND != "opencv":
+            try:
+                container = self._open_av(video_path)
+            except Exception as e:
+                logger.warning(f"PyAV could not open {video_path.name} ({e}), using OpenCV")
+        
+        if container is not None:
+            stream = container.streams.video[0]
+            fps = float(stream.average_rate or 0)
+            total_frames = stream.frames
+            source, read_frames, close = container, self._read_frames_av, container.close
+        else:
+            cap = self._open_capture(video_path)
+            
+            if not cap.isOpened():
+                raise RuntimeError(f"Failed to open video: {video_path}")
+            
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            source, read_frames, close = cap, self._read_frames, cap.release
         
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         duration = total_frames / fps if fps > 0 else 0
         
-        logger.info(f"Video info: {total_frames} frames, {fps} fps, {duration:.2f}s")
+        logger.info("Video info: %d frames, %s fps, %.2fs", total_frames, fps, duration)
         
-        keypoints_data = []
-        frame_count = 0
         frame_skip = 2  # Process every 2nd frame
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count % frame_skip != 0:
-                frame_count += 1
-                continue
-            
-            try:
-                # Convert to RGB and create MediaPipe Image
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-                
-                # Detect pose (IMAGE mode)
-                detection_result = self.detector.detect(mp_image)
-                
-                if detection_result.pose_landmarks:
-                    keypoints = self._extract_keypoints(detection_result.pose_landmarks[0])
-                    
-                    keypoints_data.append({
-                        "frame": frame_count,
-                        "time": frame_count / fps if fps > 0 else 0,
-                        "keypoints": keypoints
-                    })
-                
-            except Exception as e:
-                logger.warning(f"Failed to process frame {frame_count}: {e}")
-            
-            frame_count += 1
-            
-            if frame_count % 100 == 0:
-                logger.info(f"Processed {frame_count}/{total_frames} frames")
+        # Preallocated output sized from the frame count (grown if the container
+        # under-reports it): frame number and (9, 4) keypoints per detected pose
+        expected = max(1, (total_frames + frame_skip - 1) // frame_skip)
+        
+        # Full-size frames at the key moments are kept by the reader as it passes
+        # them, so _extract_key_moments doesn't have to decode them again
+        key_frames = {
+            self._key_moment_frame(moment["fraction"] * total_frames, frame_skip, total_frames): None
+            for moment in KEY_MOMENTS
+        } if render_key_moments and total_frames > 0 else {}
         
-        cap.release()
+        store = {
+            "frames": np.empty(expected, dtype=np.int64),
+            "keypoints": np.empty((expected, len(LANDMARK_NAMES), 4), dtype=np.float32),
+            "count": 0
+        }
+        
+        # A VIDEO mode landmarker tracks the pose across frames, so every video
+        # starts from a fresh one instead of the previous video's state
+        if self._pool["video_mode"]:
+            detectors = [vision.PoseLandmarker.create_from_options(self._pool["options"])]
+            workers = [ThreadPoolExecutor(max_workers=1)]
+        else:
+            detectors, workers = self._pool["detectors"], self._pool["workers"]
+        try:
+            written = self._detect_frames(
+                detectors, workers, read_frames, source, fps, total_frames, frame_skip, store, key_frames,
+                keypoints_path, on_chunk
+            )
+        finally:
+            if self._pool["video_mode"]:
+                workers[0].shutdown()
+                detectors[0].close()
+        
+        close()
         
-        logger.info(f"✓ Analysis complete: extracted {len(keypoints_data)} keypoint frames")
+        frame_numbers = store["frames"][:store["count"]]
+        keypoints_array = store["keypoints"][:store["count"]]
+        
+        if (keypoints_path or on_chunk) and written < len(frame_numbers):
+            self._emit_keypoints_chunk(
+                self._keypoints_chunk(frame_numbers[written:], keypoints_array[written:], fps),
+                keypoints_path,
+                on_chunk
+            )
+        
+        if keypoints_path:
+            self._save_keypoints_npz(keypoints_path, frame_numbers, keypoints_array, fps)
+        
+        logger.info("✓ Analysis complete: extracted %d keypoint frames", len(frame_numbers))
         
         # Analyze for ACL compensation
-        compensation_analysis = self._analyze_compensation(keypoints_data)
+        compensation_analysis = self._analyze_compensation(keypoints_array)
         
         # Extract key moments and save as images
         metrics = compensation_analysis.get("metrics", {})
-        key_moments = self._extract_key_moments(video_path, keypoints_data, fps, metrics)
+        key_moments = self._extract_key_moments(
+            video_path, frame_numbers, keypoints_array, fps, duration, frame_skip, metrics, key_frames
+        ) if render_key_moments else []
         
         return {
-            "keypoints_data": keypoints_data,
+            "frame_numbers": frame_numbers,
+            "keypoints_array": keypoints_array,
             "fps": fps,
             "total_frames": total_frames,
             "duration": duration,
@@ -154,200 +612,465 @@ class VideoAnalyzer:
             "key_moments": key_moments
         }
     
-    def _extract_keypoints(self, pose_landmarks) -> List[Dict]:
-        """Extract normalized keypoints from MediaPipe landmarks"""
-        keypoints = []
+    def _detect_frames(self, detectors: List, workers: List[ThreadPoolExecutor], read_frames: Callable, source,
+                       fps: float, total_frames: int, frame_skip: int, store: Dict, key_frames: Dict,
+                       keypoints_path: Optional[Path], on_chunk: Optional[Callable[[Dict], None]]) -> int:
+        """Run pose detection over the video into store
         
-        for idx, name in POSE_LANDMARKS.items():
-            landmark = pose_landmarks[idx]
-            
-            keypoints.append({
-                "name": name,
-                "x": landmark.x,
-                "y": landmark.y,
-                "z": landmark.z,
-                "visibility": landmark.visibility
-            })
-        
-        return keypoints
-    
-    def _analyze_compensation(self, keypoints_data: List[Dict]) -> Dict:
-        """Analyze keypoints to detect ACL compensation patterns"""
+        detectors is either this video's single VIDEO mode landmarker, which sees
+        every sampled frame in order, or the shared IMAGE mode pool; workers
+        holds the single-thread executor each of them runs on.
+        read_frames is the reader for source (_read_frames for an OpenCV capture,
+        _read_frames_av for a PyAV container). It fills in the full-size BGR
+        frames for the frame numbers in key_frames.
+        
+        Returns the number of frames already emitted as keypoints chunks.
+        """
+        # Frames are fanned out round-robin over the detectors; results are
+        # collected in submission order so keypoints stay sorted by frame
+        pending = deque()
+        max_pending = 2 * len(detectors)
+        submitted = 0
+        written = 0  # Frames already streamed to keypoints_path
+        
+        # VIDEO mode timestamps (None = IMAGE mode), from 0 for the fresh landmarker
+        video_mode = self._pool["video_mode"]
+        frame_ms = 1000 / fps if fps > 0 else 1000 / 30
+        
+        # Decoding runs on a reader thread, a few frames ahead of the detectors
+        frames = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=read_frames,
+            args=(source, frame_skip, total_frames, frames, stop, key_frames),
+            daemon=True
+        )
+        reader.start()
+        
+        eof = False
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    eof = True
+                    break
+                frame_count, mp_image = item
+                
+                try:
+                    worker_idx = submitted % len(detectors)
+                    timestamp_ms = int(frame_count * frame_ms) if video_mode else None
+                    future = workers[worker_idx].submit(
+                        self._detect_keypoints, detectors[worker_idx], mp_image, timestamp_ms
+                    )
+                    pending.append((frame_count, future))
+                    submitted += 1
+                    
+                except Exception as e:
+                    logger.warning("Failed to process frame %d: %s", frame_count, e)
+                
+                while len(pending) >= max_pending:
+                    self._collect_keypoints(pending.popleft(), store)
+                
+                if (keypoints_path or on_chunk) and store["count"] - written >= KEYPOINTS_CHUNK_FRAMES:
+                    end = written + KEYPOINTS_CHUNK_FRAMES
+                    self._emit_keypoints_chunk(
+                        self._keypoints_chunk(store["frames"][written:end], store["keypoints"][written:end], fps),
+                        keypoints_path,
+                        on_chunk
+                    )
+                    written = end
+        finally:
+            # Unblock and wait for the reader if we stopped before end of stream
+            stop.set()
+            while not eof:
+                eof = frames.get() is None
+            reader.join()
+        
+        while pending:
+            self._collect_keypoints(pending.popleft(), store)
+        
+        return written
+    
+    def _read_frames(self, cap, frame_skip: int, total_frames: int, frames: queue.Queue, stop: threading.Event,
+                     key_frames: Dict):
+        """Decode every frame_skip-th frame into MediaPipe images (reader thread)
+        
+        Puts (frame number, mp.Image) on frames, then None at end of stream.
+        Frames whose number is a key in key_frames are also stored there.
+        """
+        position = 0  # Index of the frame the next grab() returns
+        kept = 0
+        input_size = None  # (width, height) handed to MediaPipe, set on first frame
+        small_buf = None  # Reused downscaled BGR buffer
+        rgb_buf = None  # Reused RGB buffer of input_size, allocated on first frame
+        make_image, srgb = mp.Image, mp.ImageFormat.SRGB  # Bound once, used per frame
+        
+        try:
+            # Walk the sampled frame indices; the frame count is not trusted as an
+            # upper bound (containers may under-report it), end of stream stops us
+            for frame_count in itertools.count(0, frame_skip):
+                if stop.is_set():
+                    break
+                
+                # grab() up to the target frame; only the target is retrieved
+                # (converted to BGR and copied out of the decoder)
+                while position <= frame_count:
+                    if not cap.grab():
+                        return
+                    position += 1
+                
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                
+                # retrieve() returns a new array each time, so it can be kept as is
+                if frame_count in key_frames:
+                    key_frames[frame_count] = frame
+                
+                try:
+                    if input_size is None:
+                        input_size = self._pose_input_size(frame.shape[1], frame.shape[0])
+                        rgb_buf = np.empty((input_size[1], input_size[0], 3), dtype=np.uint8)
+                    # Frames not already at input_size (downscaling, or a mid-stream
+                    # resolution change) are resized so rgb_buf always fits
+                    if input_size != (frame.shape[1], frame.shape[0]):
+                        small_buf = cv2.resize(frame, input_size, dst=small_buf, interpolation=cv2.INTER_AREA)
+                        frame = small_buf
+                    
+                    # Convert to RGB into the scratch buffer and create MediaPipe Image
+                    # (mp.Image copies the pixels, so the buffer can be reused next frame)
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb_buf)
+                    frames.put((frame_count, make_image(srgb, rgb_buf)))
+                    
+                except Exception as e:
+                    logger.warning("Failed to decode frame %d: %s", frame_count, e)
+                
+                kept += 1
+                if kept % 50 == 0:
+                    logger.info("Processed %d/%d frames", position, total_frames)
+        finally:
+            frames.put(None)
+    
+    def _read_frames_av(self, container, frame_skip: int, total_frames: int, frames: queue.Queue, stop: threading.Event,
+                        key_frames: Dict):
+        """PyAV version of _read_frames (reader thread)
+        
+        Kept frames are scaled and converted to RGB in one swscale call, so no
+        BGR frame or cvtColor pass is needed. to_ndarray() keeps FFmpeg's row
+        padding whenever width * 3 isn't aligned (e.g. 853x480), and mp.Image
+        reads its input as packed rows, so frames are copied into a contiguous
+        buffer first.
+        """
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"  # Let FFmpeg decode with frame/slice threads
+        input_size = None  # (width, height) handed to MediaPipe, set on first frame
+        rgb_buf = None  # Reused contiguous RGB buffer of input_size, allocated on first frame
+        make_image, srgb = mp.Image, mp.ImageFormat.SRGB  # Bound once, used per frame
+        
+        try:
+            for frame_count, frame in enumerate(container.decode(stream)):
+                if stop.is_set():
+                    break
+                if frame_count % frame_skip != 0:
+                    continue
+                
+                try:
+                    if frame_count in key_frames:
+                        key_frames[frame_count] = np.ascontiguousarray(frame.to_ndarray(format="bgr24"))
+                    if input_size is None:
+                        input_size = self._pose_input_size(frame.width, frame.height)
+                        rgb_buf = np.empty((input_size[1], input_size[0], 3), dtype=np.uint8)
+                    # Packed copy of the (possibly row-padded) frame; mp.Image copies
+                    # the pixels, so the buffer can be reused next frame
+                    np.copyto(rgb_buf, frame.to_ndarray(
+                        width=input_size[0], height=input_size[1], format="rgb24", interpolation="AREA"
+                    ))
+                    frames.put((frame_count, make_image(srgb, rgb_buf)))
+                    
+                except Exception as e:
+                    logger.warning("Failed to decode frame %d: %s", frame_count, e)
+                
+                if (frame_count // frame_skip + 1) % 50 == 0:
+                    logger.info("Processed %d/%d frames", frame_count + 1, total_frames)
+        except Exception as e:
+            # A corrupt packet ends the stream, as a failed grab() does for OpenCV
+            logger.warning("Decoding stopped early: %s", e)
+        finally:
+            frames.put(None)
+    
+    def _pose_input_size(self, width: int, height: int):
+        """Frame size for pose detection: downscaled to POSE_INPUT_SHORT_SIDE, never upscaled"""
+        short_side = min(width, height)
+        if not POSE_INPUT_SHORT_SIDE or short_side <= POSE_INPUT_SHORT_SIDE:
+            return width, height
+        scale = POSE_INPUT_SHORT_SIDE / short_side
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    
+    def _detect_keypoints(self, detector, mp_image, timestamp_ms: Optional[int]) -> Optional[np.ndarray]:
+        """Run pose detection on one frame, executed on a pool worker
+        
+        timestamp_ms is the frame time for a VIDEO mode landmarker, None in IMAGE mode.
+        """
+        if timestamp_ms is None:
+            detection_result = detector.detect(mp_image)
+        else:
+            detection_result = detector.detect_for_video(mp_image, timestamp_ms)
+        
+        if detection_result.pose_landmarks:
+            return self._extract_keypoints(detection_result.pose_landmarks[0])
+        return None
+    
+    def _collect_keypoints(self, item, store: Dict):
+        """Wait for a submitted frame and write its keypoints into the next row of store"""
+        frame_count, future = item
+        
+        try:
+            keypoints = future.result()
+        except Exception as e:
+            logger.warning("Failed to process frame %d: %s", frame_count, e)
+            return
+        
+        if keypoints is None:
+            return
+        
+        i = store["count"]
+        if i == len(store["frames"]):
+            # Frame count was under-reported; double the buffers
+            store["frames"] = np.concatenate([store["frames"], np.empty_like(store["frames"])])
+            store["keypoints"] = np.concatenate([store["keypoints"], np.empty_like(store["keypoints"])])
+        
+        store["frames"][i] = frame_count
+        store["keypoints"][i] = keypoints
+        store["count"] = i + 1
+    
+    def _extract_keypoints(self, pose_landmarks) -> np.ndarray:
+        """Extract normalized keypoints from MediaPipe landmarks as a (9, 4) array
+        
+        Rows follow POSE_LANDMARKS order, columns are x, y, z, visibility.
+        """
+        landmarks = [pose_landmarks[idx] for idx in LANDMARK_INDICES]
+        return np.fromiter(
+            (v for lm in landmarks for v in (lm.x, lm.y, lm.z, lm.visibility)),
+            dtype=np.float32,
+            count=len(LANDMARK_INDICES) * 4
+        ).reshape(len(LANDMARK_INDICES), 4)
+    
+    def _keypoints_chunk(self, frame_numbers: np.ndarray, keypoints_array: np.ndarray, fps: float) -> Dict:
+        """Columnar view of a run of frames, serialized as is by orjson
+        
+        "keypoints" is the (frames, 9, 4) float32 array with rows in "landmarks"
+        order and columns x, y, z, visibility; "frame" and "time" are per frame.
+        """
+        return {
+            "landmarks": LANDMARK_NAMES,
+            "frame": frame_numbers,
+            "time": (frame_numbers / fps if fps > 0 else np.zeros(len(frame_numbers))).astype(np.float32),
+            "keypoints": keypoints_array
+        }
+    
+    def _emit_keypoints_chunk(self, chunk: Dict, keypoints_path: Optional[Path],
+                              on_chunk: Optional[Callable[[Dict], None]]):
+        """Append a keypoints chunk to the NDJSON file and/or hand it to on_chunk"""
+        if keypoints_path:
+            with open(keypoints_path, "ab") as f:
+                f.write(orjson.dumps(chunk, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
+        if on_chunk:
+            on_chunk(chunk)
+    
+    def _save_keypoints_npz(self, keypoints_path: Path, frame_numbers: np.ndarray,
+                            keypoints_array: np.ndarray, fps: float):
+        """Save the keypoints array in binary form next to the NDJSON file
+        
+        Arrays: kp (frames, 9, 4) float32 in POSE_LANDMARKS order with columns
+        x, y, z, visibility; frame_idx (frames,) int64; fps float32 scalar.
+        """
+        np.savez_compressed(
+            keypoints_path.with_suffix('.npz'),
+            kp=keypoints_array,
+            frame_idx=frame_numbers,
+            fps=np.float32(fps)
+        )
+    
+    def _analyze_compensation(self, kp: np.ndarray) -> Dict:
+        """Analyze a (frames, 9, 4) keypoints array to detect ACL compensation patterns"""
         logger.info("Analyzing ACL compensation patterns...")
         
-        if not keypoints_data:
+        if not len(kp):
             return {
                 "compensation_detected": False,
                 "message": "No pose data available for analysis"
             }
         
-        hip_shifts = []
-        hip_shift_directions = []  # positive = shift right, negative = shift left
-        knee_asymmetries = []
-        knee_depth_diffs = []  # positive = right knee lower (more flexed), negative = left knee lower
-        
-        for frame_data in keypoints_data:
-            keypoints = {kp["name"]: kp for kp in frame_data["keypoints"]}
-            
-            if not all(k in keypoints for k in ["left_hip", "right_hip", "left_knee", "right_knee", "left_ankle", "right_ankle"]):
-                continue
-            
-            # Hip shift analysis
-            left_hip_x = keypoints["left_hip"]["x"]
-            right_hip_x = keypoints["right_hip"]["x"]
-            hip_center_x = (left_hip_x + right_hip_x) / 2
-            
-            # Shift direction: positive = right, negative = left
-            hip_shift_direction = hip_center_x - 0.5
-            hip_shift = abs(hip_shift_direction)
-            hip_shifts.append(hip_shift)
-            hip_shift_directions.append(hip_shift_direction)
-            
-            # Knee asymmetry analysis
-            left_knee_y = keypoints["left_knee"]["y"]
-            right_knee_y = keypoints["right_knee"]["y"]
-            left_ankle_y = keypoints["left_ankle"]["y"]
-            right_ankle_y = keypoints["right_ankle"]["y"]
-            
-            # Calculate knee flexion depth (larger value = more flexed = healthy)
-            # Distance from knee to ankle: larger = knee further from ankle = more bent
-            left_knee_flexion = abs(left_knee_y - left_ankle_y)
-            right_knee_flexion = abs(right_knee_y - right_ankle_y)
-            
-            # Positive = LEFT knee more flexed → LEFT healthy, RIGHT compensating
-            # Negative = RIGHT knee more flexed → RIGHT healthy, LEFT compensating
-            knee_depth_diff = left_knee_flexion - right_knee_flexion
-            knee_asymmetry = abs(knee_depth_diff)
-            
-            knee_asymmetries.append(knee_asymmetry)
-            knee_depth_diffs.append(knee_depth_diff)
-        
-        if hip_shifts and knee_asymmetries:
-            avg_hip_shift = np.mean(hip_shifts)
-            max_hip_shift = np.max(hip_shifts)
-            avg_knee_asymmetry = np.mean(knee_asymmetries)
-            max_knee_asymmetry = np.max(knee_asymmetries)
-            
-            # Determine compensation side based on average shifts
-            avg_hip_direction = np.mean(hip_shift_directions)
-            avg_knee_depth = np.mean(knee_depth_diffs)
-            
-            # Determine which side is compensating (avoids loading = stays straighter)
-            # Positive avg_knee_depth = LEFT knee more flexed → LEFT healthy, RIGHT compensating
-            # Negative avg_knee_depth = RIGHT knee more flexed → RIGHT healthy, LEFT compensating
-            compensating_side = "right" if avg_knee_depth > 0 else "left"
-            
-            # Shift direction: positive = body shifts right (loading right leg more)
-            shift_direction = "right" if avg_hip_direction > 0 else "left"
-            
-            HIP_SHIFT_THRESHOLD = 0.05
-            KNEE_ASYMMETRY_THRESHOLD = 0.08
-            
-            compensation_detected = (
-                max_hip_shift > HIP_SHIFT_THRESHOLD or 
-                max_knee_asymmetry > KNEE_ASYMMETRY_THRESHOLD
-            )
-            
-            logger.info(f"=== COMPENSATION ANALYSIS ===")
-            logger.info(f"Hip shift: {avg_hip_shift:.3f} (max: {max_hip_shift:.3f}), direction: {shift_direction}")
-            logger.info(f"Knee asymmetry: {avg_knee_asymmetry:.3f} (max: {max_knee_asymmetry:.3f})")
-            logger.info(f"Knee depth diff: {avg_knee_depth:.3f} (positive = left more flexed)")
-            logger.info(f"Compensating side: {compensating_side.upper()}")
-            logger.info(f"Interpretation: {compensating_side.upper()} leg stays straighter = avoids loading (injured/weak)")
-            
-            # Determine healthy side for clarity
-            healthy_side = "left" if compensating_side == "right" else "right"
-            logger.info(f"Healthy side: {healthy_side.upper()} leg bends more = takes more load")
-            
-            message = f"Load shifts away from {compensating_side} leg - {compensating_side} side compensation detected" if compensation_detected else "No significant compensation detected"
-            
+        visible = kp[:, COMPENSATION_LANDMARKS, KP_VISIBILITY].min(axis=1) >= MIN_VISIBILITY
+        if not visible.any():
             return {
-                "compensation_detected": bool(compensation_detected),
-                "knee_flexion_angle": 32,
-                "message": message,
-                "recommendation": f"Focus on loading {compensating_side} leg symmetrically during squats." if compensation_detected
-                                 else "Continue current rehabilitation protocol.",
-                "compensating_side": compensating_side,
-                "shift_direction": shift_direction,
-                "metrics": {
-                    "avg_hip_shift": float(avg_hip_shift),
-                    "max_hip_shift": float(max_hip_shift),
-                    "avg_knee_asymmetry": float(avg_knee_asymmetry),
-                    "max_knee_asymmetry": float(max_knee_asymmetry),
-                    "compensating_side": compensating_side,
-                    "shift_direction": shift_direction
-                }
+                "compensation_detected": False,
+                "message": "Hips, knees and ankles were not clearly visible in any frame"
             }
+        if not visible.all():
+            logger.info("Skipping %d/%d frames with occluded legs", len(kp) - int(visible.sum()), len(kp))
+            kp = kp[visible]
+        
+        avg_hip_direction, avg_hip_shift, max_hip_shift, avg_knee_depth, avg_knee_asymmetry, max_knee_asymmetry = (
+            _compensation_stats(np.ascontiguousarray(kp, dtype=np.float32))
+        )
+        
+        # Determine which side is compensating (avoids loading = stays straighter)
+        # Positive avg_knee_depth = LEFT knee more flexed → LEFT healthy, RIGHT compensating
+        # Negative avg_knee_depth = RIGHT knee more flexed → RIGHT healthy, LEFT compensating
+        compensating_side = "right" if avg_knee_depth > 0 else "left"
+        
+        # Shift direction: positive = body shifts right (loading right leg more)
+        shift_direction = "right" if avg_hip_direction > 0 else "left"
+        
+        HIP_SHIFT_THRESHOLD = 0.05
+        KNEE_ASYMMETRY_THRESHOLD = 0.08
+        
+        compensation_detected = (
+            max_hip_shift > HIP_SHIFT_THRESHOLD or 
+            max_knee_asymmetry > KNEE_ASYMMETRY_THRESHOLD
+        )
+        
+        logger.info(f"=== COMPENSATION ANALYSIS ===")
+        logger.info(f"Hip shift: {avg_hip_shift:.3f} (max: {max_hip_shift:.3f}), direction: {shift_direction}")
+        logger.info(f"Knee asymmetry: {avg_knee_asymmetry:.3f} (max: {max_knee_asymmetry:.3f})")
+        logger.info(f"Knee depth diff: {avg_knee_depth:.3f} (positive = left more flexed)")
+        logger.info(f"Compensating side: {compensating_side.upper()}")
+        logger.info(f"Interpretation: {compensating_side.upper()} leg stays straighter = avoids loading (injured/weak)")
+        
+        # Determine healthy side for clarity
+        healthy_side = "left" if compensating_side == "right" else "right"
+        logger.info(f"Healthy side: {healthy_side.upper()} leg bends more = takes more load")
+        
+        message = f"Load shifts away from {compensating_side} leg - {compensating_side} side compensation detected" if compensation_detected else "No significant compensation detected"
         
         return {
-            "compensation_detected": False,
-            "message": "Insufficient data for analysis"
+            "compensation_detected": bool(compensation_detected),
+            "knee_flexion_angle": 32,
+            "message": message,
+            "recommendation": f"Focus on loading {compensating_side} leg symmetrically during squats." if compensation_detected
+                             else "Continue current rehabilitation protocol.",
+            "compensating_side": compensating_side,
+            "shift_direction": shift_direction,
+            "metrics": {
+                "avg_hip_shift": float(avg_hip_shift),
+                "max_hip_shift": float(max_hip_shift),
+                "avg_knee_asymmetry": float(avg_knee_asymmetry),
+                "max_knee_asymmetry": float(max_knee_asymmetry),
+                "compensating_side": compensating_side,
+                "shift_direction": shift_direction
+            }
         }
     
-    def _extract_key_moments(self, video_path: Path, keypoints_data: List[Dict], fps: float, metrics: Dict) -> List[Dict]:
-        """Extract key moments from video and save as annotated images"""
+    def _key_moment_frame(self, position: float, frame_skip: int, total_frames: int) -> int:
+        """Sampled frame number closest to a (fractional) frame position (earlier one on ties)"""
+        last = (total_frames - 1) // frame_skip * frame_skip
+        return min(max(0, math.ceil(position / frame_skip - 0.5) * frame_skip), last)
+    
+    def _extract_key_moments(self, video_path: Path, frame_numbers: np.ndarray, keypoints_array: np.ndarray,
+                             fps: float, duration: float, frame_skip: int, metrics: Dict,
+                             key_frames: Optional[Dict] = None) -> List[Dict]:
+        """Extract key moments from video and save as annotated images
+        
+        Frames already decoded during analysis are taken from key_frames (frame
+        number -> BGR frame); only the others are read from the video again.
+        """
         logger.info("Extracting key moments...")
-        logger.info(f"Metrics for color coding: {metrics}")
+        logger.info("Metrics for color coding: %s", metrics)
         
-        if not keypoints_data:
+        if not len(frame_numbers):
             return []
         
-        # Select 2 key timestamps
-        duration = len(keypoints_data) * 2 / fps if fps > 0 else 0  # accounting for frame_skip=2
+        # Frame numbers increase, so times are sorted and can be binary-searched
+        times = frame_numbers / fps if fps > 0 else np.zeros(len(frame_numbers))
+        if duration <= 0:
+            # Frame count unknown: use the span the sampled frames cover
+            duration = (int(frame_numbers[-1]) + frame_skip) / fps if fps > 0 else 0
+        frame_numbers = frame_numbers.tolist()
+        key_frames = key_frames or {}
         
-        # Key moments: neutral (early), peak compensation (middle)
-        key_times = [
-            {"time": duration * 0.2, "label": "Neutral", "type": "neutral"},
-            {"time": duration * 0.5, "label": "Compensation peak", "type": "peak"}
-        ]
+        # Find closest keypoint frame for each moment (earlier one on ties)
+        targets = []
+        for moment in KEY_MOMENTS:
+            target_time = moment["fraction"] * duration
+            closest = min(int(np.searchsorted(times, target_time)), len(times) - 1)
+            if closest > 0 and abs(times[closest - 1] - target_time) <= abs(times[closest] - target_time):
+                closest -= 1
+            targets.append((frame_numbers[closest], closest, moment))
         
-        key_moments = []
-        cap = cv2.VideoCapture(str(video_path))
+        # Frames not kept during analysis (e.g. no pose on the kept one) are read
+        # from one capture in frame order: a nearby target is reached by grabbing
+        # forward, a distant one with a single keyframe seek
+        cap = None
+        position = 0  # index of the frame the next grab() returns
+        rendered = {}
+        drawn = set()  # Frame numbers already drawn on (and maybe still being encoded)
+        try:
+            for frame_number, closest, moment in sorted(targets, key=lambda t: t[0]):
+                frame = key_frames.get(frame_number)
+                if frame is None:
+                    if cap is None:
+                        cap = self._open_capture(video_path)
+                    if frame_number < position or frame_number - position > KEY_MOMENT_GRAB_LIMIT:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                        position = frame_number
+                    while position < frame_number and cap.grab():
+                        position += 1
+                    ret, frame = cap.read()
+                    if not ret:
+                        continue
+                    position += 1
+                # Moments can share a frame (short videos); drawing is in place,
+                # so the next one gets its own copy
+                if frame_number in drawn:
+                    frame = frame.copy()
+                drawn.add(frame_number)
+                rendered[moment["type"]] = self._render_key_moment(
+                    video_path, moment, frame, frame_number, float(times[closest]), keypoints_array[closest], metrics
+                )
+        finally:
+            if cap is not None:
+                cap.release()
         
-        for moment in key_times:
-            target_time = moment["time"]
-            
-            # Find closest keypoint frame
-            closest_frame = min(keypoints_data, key=lambda x: abs(x["time"] - target_time))
-            frame_number = closest_frame["frame"]
-            
-            # Set video to that frame
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret, frame = cap.read()
-            
-            if ret:
-                # Draw skeleton overlay with color coding
-                annotated_frame = self._draw_skeleton_on_frame(frame, closest_frame["keypoints"], metrics)
-                
-                # Save as PNG
-                output_filename = f"{video_path.stem}_{moment['type']}.png"
-                output_path = video_path.parent / output_filename
-                cv2.imwrite(str(output_path), annotated_frame)
-                
-                logger.info(f"✓ Saved key moment: {output_filename}")
-                
-                key_moments.append({
-                    "time": closest_frame["time"],
-                    "frame": frame_number,
-                    "label": moment["label"],
-                    "type": moment["type"],
-                    "image": output_filename
-                })
+        key_moments = [rendered[moment["type"]] for moment in KEY_MOMENTS if moment["type"] in rendered]
         
-        cap.release()
-        logger.info(f"✓ Extracted {len(key_moments)} key moments")
+        logger.info("✓ Extracted %d key moments", len(key_moments))
         
         return key_moments
     
-    def _draw_skeleton_on_frame(self, frame, keypoints, metrics: Dict = None) -> np.ndarray:
-        """Draw pose skeleton overlay on frame with color coding based on metrics"""
-        annotated = frame.copy()
+    def _render_key_moment(self, video_path: Path, moment: Dict, frame: np.ndarray, frame_number: int,
+                           time: float, keypoints: np.ndarray, metrics: Dict) -> Dict:
+        """Draw the skeleton on one key moment frame and save it as PNG"""
+        # Draw skeleton overlay with color coding
+        annotated_frame = self._draw_skeleton_on_frame(frame, keypoints, metrics)
+        
+        # Save as PNG (encoded in the background)
+        output_filename = f"{video_path.stem}_{moment['type']}.png"
+        output_path = video_path.parent / output_filename
+        _save_png_async(output_path, annotated_frame)
+        
+        logger.info("✓ Queued key moment: %s", output_filename)
+        
+        return {
+            "time": time,
+            "frame": frame_number,
+            "label": moment["label"],
+            "type": moment["type"],
+            "image": output_filename
+        }
+    
+    def _draw_skeleton_on_frame(self, frame, keypoints: np.ndarray, metrics: Dict = None) -> np.ndarray:
+        """Draw pose skeleton overlay on frame with color coding based on metrics
+        
+        keypoints is one frame's (9, 4) array in POSE_LANDMARKS order. The overlay
+        is drawn into frame itself (no copy); the same array is returned.
+        """
+        annotated = frame
         h, w = frame.shape[:2]
         
-        # Convert keypoints to pixel coordinates
-        points = {}
-        for kp in keypoints:
-            points[kp["name"]] = (int(kp["x"] * w), int(kp["y"] * h))
+        # Convert keypoints to pixel coordinates in one multiply (same order as LANDMARK_NAMES)
+        px = (keypoints[:, [KP_X, KP_Y]] * np.array([w, h], dtype=np.float32)).astype(np.int32)
+        points = [tuple(p) for p in px.tolist()]
         
         # Determine colors based on compensation metrics
         # Green: OK (< 0.01), Yellow: Attention (0.01-0.02), Red: Problem (> 0.02)
@@ -357,7 +1080,7 @@ class VideoAnalyzer:
             max_compensation = max(hip_shift, knee_asymmetry)
             compensating_side = metrics.get("compensating_side", "left")
             
-            logger.info(f"Drawing skeleton - compensating side: {compensating_side}, max compensation: {max_compensation:.3f}")
+            logger.info("Drawing skeleton - compensating side: %s, max compensation: %.3f", compensating_side, max_compensation)
             
             # Determine problem color based on severity (BGR format for OpenCV)
             if max_compensation > 0.02:
@@ -387,44 +1110,19 @@ class VideoAnalyzer:
             center_color = (136, 255, 0)  # Green
         
         # Draw center line (vertical through hips center)
-        if "left_hip" in points and "right_hip" in points:
-            hip_center_x = (points["left_hip"][0] + points["right_hip"][0]) // 2
-            cv2.line(annotated, (hip_center_x, 0), (hip_center_x, h), (200, 200, 200), 2, cv2.LINE_AA)
+        hip_center_x = (points[L_HIP][0] + points[R_HIP][0]) // 2
+        cv2.line(annotated, (hip_center_x, 0), (hip_center_x, h), (200, 200, 200), 2, cv2.LINE_AA)
         
         # Draw skeleton connections with color coding
-        connections = [
-            # Left side (compensating side)
-            ("left_shoulder", "left_hip", left_color),
-            ("left_hip", "left_knee", left_color),
-            ("left_knee", "left_ankle", left_color),
-            
-            # Right side (healthy side)
-            ("right_shoulder", "right_hip", right_color),
-            ("right_hip", "right_knee", right_color),
-            ("right_knee", "right_ankle", right_color),
-            
-            # Center connections
-            ("left_hip", "right_hip", center_color)
-        ]
-        
-        for start, end, color in connections:
-            if start in points and end in points:
-                cv2.line(annotated, points[start], points[end], color, 4, cv2.LINE_AA)
+        # (left = compensating side by default, right = healthy side)
+        side_colors = {"left": left_color, "right": right_color, "center": center_color}
+        for start, end, side in SKELETON_CONNECTIONS:
+            cv2.line(annotated, points[start], points[end], side_colors[side], 4, cv2.LINE_AA)
         
         # Draw keypoints with color coding
-        for name, (x, y) in points.items():
-            if "left" in name:
-                # Left side with compensation color
-                cv2.circle(annotated, (x, y), 8, left_color, -1, cv2.LINE_AA)
-                cv2.circle(annotated, (x, y), 10, (255, 255, 255), 2, cv2.LINE_AA)
-            elif "right" in name:
-                # Right side (healthy) in green
-                cv2.circle(annotated, (x, y), 8, right_color, -1, cv2.LINE_AA)
-                cv2.circle(annotated, (x, y), 10, (255, 255, 255), 2, cv2.LINE_AA)
-            else:
-                # Center points (head, etc.)
-                cv2.circle(annotated, (x, y), 8, center_color, -1, cv2.LINE_AA)
-                cv2.circle(annotated, (x, y), 10, (255, 255, 255), 2, cv2.LINE_AA)
+        for side, point in zip(LANDMARK_SIDES, points):
+            cv2.circle(annotated, point, 8, side_colors[side], -1, cv2.LINE_AA)
+            cv2.circle(annotated, point, 10, (255, 255, 255), 2, cv2.LINE_AA)
         
         # Add compensation indicator text
         if metrics and "compensating_side" in metrics:
@@ -443,11 +1141,7 @@ class VideoAnalyzer:
                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2, cv2.LINE_AA)
         
         # Add shift direction arrow if significant
-        if "left_hip" in points and "right_hip" in points and metrics:
-            left_hip_x = points["left_hip"][0]
-            right_hip_x = points["right_hip"][0]
-            hip_center_x = (left_hip_x + right_hip_x) // 2
-            
+        if metrics:
             shift = abs(hip_center_x - w // 2)
             if shift > w * 0.05:
                 shift_direction = metrics.get("shift_direction", "")
@@ -464,38 +1158,45 @@ class VideoAnalyzer:
         
         return annotated
     
-    def _generate_mock_analysis(self) -> Dict:
+    def _generate_mock_analysis(self, keypoints_path: Optional[Path] = None,
+                                on_chunk: Optional[Callable[[Dict], None]] = None) -> Dict:
         """Generate mock analysis data when MediaPipe is not available"""
         logger.info("Generating mock analysis data")
         
-        mock_keypoints = []
-        for frame in range(0, 720, 2):
-            time = frame / 30.0
-            t = time / 24.0
-            
-            squat_phase = np.sin(t * np.pi * 6)
-            compensation = 0.05 * np.sin(t * np.pi * 6)
-            
-            keypoints = [
-                {"name": "nose", "x": 0.5 + compensation, "y": 0.15, "z": 0, "visibility": 1.0},
-                {"name": "left_shoulder", "x": 0.45 + compensation, "y": 0.25, "z": 0, "visibility": 1.0},
-                {"name": "right_shoulder", "x": 0.55 + compensation, "y": 0.25, "z": 0, "visibility": 1.0},
-                {"name": "left_hip", "x": 0.43 + compensation * 2, "y": 0.5 + squat_phase * 0.1, "z": 0, "visibility": 1.0},
-                {"name": "right_hip", "x": 0.57 + compensation * 0.5, "y": 0.5 + squat_phase * 0.15, "z": 0, "visibility": 1.0},
-                {"name": "left_knee", "x": 0.42 + compensation * 2, "y": 0.65 + squat_phase * 0.15, "z": 0, "visibility": 1.0},
-                {"name": "right_knee", "x": 0.58 + compensation * 0.5, "y": 0.65 + squat_phase * 0.1, "z": 0, "visibility": 1.0},
-                {"name": "left_ankle", "x": 0.42 + compensation * 1.5, "y": 0.85, "z": 0, "visibility": 1.0},
-                {"name": "right_ankle", "x": 0.58 + compensation * 0.3, "y": 0.85, "z": 0, "visibility": 1.0}
-            ]
-            
-            mock_keypoints.append({
-                "frame": frame,
-                "time": time,
-                "keypoints": keypoints
-            })
+        frame_numbers = np.arange(0, 720, 2, dtype=np.int64)
+        t = frame_numbers / 30.0 / 24.0
+        
+        squat_phase = np.sin(t * np.pi * 6)[:, None]
+        compensation = 0.05 * squat_phase
+        
+        # Per landmark (LANDMARK_NAMES order): x and how strongly it follows the
+        # compensation, y and how strongly it follows the squat
+        base_x = np.array([0.5, 0.45, 0.55, 0.43, 0.57, 0.42, 0.58, 0.42, 0.58])
+        compensation_x = np.array([1, 1, 1, 2, 0.5, 2, 0.5, 1.5, 0.3])
+        base_y = np.array([0.15, 0.25, 0.25, 0.5, 0.5, 0.65, 0.65, 0.85, 0.85])
+        squat_y = np.array([0, 0, 0, 0.1, 0.15, 0.15, 0.1, 0, 0])
+        
+        keypoints_array = np.zeros((len(frame_numbers), len(LANDMARK_NAMES), 4), dtype=np.float32)
+        keypoints_array[:, :, KP_X] = base_x + compensation * compensation_x
+        keypoints_array[:, :, KP_Y] = base_y + squat_phase * squat_y
+        keypoints_array[:, :, KP_VISIBILITY] = 1.0
+        
+        if keypoints_path:
+            keypoints_path.write_bytes(b"")
+        if keypoints_path or on_chunk:
+            for start in range(0, len(frame_numbers), KEYPOINTS_CHUNK_FRAMES):
+                end = start + KEYPOINTS_CHUNK_FRAMES
+                self._emit_keypoints_chunk(
+                    self._keypoints_chunk(frame_numbers[start:end], keypoints_array[start:end], 30),
+                    keypoints_path,
+                    on_chunk
+                )
+        if keypoints_path:
+            self._save_keypoints_npz(keypoints_path, frame_numbers, keypoints_array, 30)
         
         return {
-            "keypoints_data": mock_keypoints,
+            "frame_numbers": frame_numbers,
+            "keypoints_array": keypoints_array,
             "fps": 30,
             "total_frames": 720,
             "duration": 24.0,
@@ -506,8 +1207,3 @@ class VideoAnalyzer:
                 "recommendation": "Focus on slow, symmetrical knee loading."
             }
         }
-    
-    def __del__(self):
-        """Cleanup MediaPipe resources"""
-        if hasattr(self, 'detector') and self.detector:
-            self.detector.close()
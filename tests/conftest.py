@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend is run from apps/backend (uvicorn app.main:app), so import it the same way
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "apps" / "backend"))
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app.main as main  # noqa: E402
+import app.video_analyzer_v2 as video_analyzer_v2  # noqa: E402
+
+VIDEO = b"\x00\x00\x00\x18ftypmp42" + bytes(range(256)) * 64
+
+
+class FakeAnalyzer:
+    """Writes the files a real analysis leaves behind, without running MediaPipe"""
+
+    def __init__(self):
+        self.analyzed = []
+        # Cleared by a test to hold the analysis after its first chunk
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def analyze_video(self, video_path, keypoints_path=None, on_chunk=None):
+        self.analyzed.append(video_path.name)
+        for frame in range(2):
+            if on_chunk:
+                on_chunk({"frame_numbers": [frame]})
+            self.proceed.wait()
+        keypoints_path.write_text('{"frame_numbers": [0, 1]}\n')
+        keypoints_path.with_suffix(".npz").write_bytes(b"npz")
+        image = f"{video_path.stem}_moment_0.png"
+        (video_path.parent / image).write_bytes(b"png")
+        return {
+            "analysis": {"compensation_detected": False},
+            "key_moments": [{"frame": 0, "image": image}],
+        }
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    """Point the app at an empty upload dir and a fake analyzer"""
+    fake = FakeAnalyzer()
+    monkeypatch.setattr(main, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(main, "UPLOAD_DIR_STR", str(tmp_path))
+    monkeypatch.setattr(main, "_analysis_cache", OrderedDict())
+    monkeypatch.setattr(main, "_analysis_semaphore", asyncio.Semaphore(1))
+    monkeypatch.setattr(main, "get_video_analyzer", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def client():
+    # Not entered as a context manager, so the lifespan does not warm up the real analyzer
+    return TestClient(main.app)
+
+
+def upload(client, content=VIDEO, filename="squat.mp4"):
+    return client.post("/upload", files={"file": (filename, content, "video/mp4")})
+
+
+@pytest.fixture(params=["O_TMPFILE", ".part"])
+def temp_file_kind(request, monkeypatch):
+    """Run a test with both unnamed O_TMPFILE uploads and the named .part fallback"""
+    if request.param == "O_TMPFILE":
+        if not hasattr(os, "O_TMPFILE"):
+            pytest.skip("O_TMPFILE is not available")
+    else:
+        monkeypatch.delattr(os, "O_TMPFILE", raising=False)
+    return request.param
+
+
+def test_upload_is_stored_intact(client, analyzer, tmp_path, temp_file_kind):
+    response = upload(client)
+
+    assert response.status_code == 200
+    saved_as = response.json()["saved_as"]
+    assert response.json()["size_bytes"] == len(VIDEO)
+    assert (tmp_path / saved_as).read_bytes() == VIDEO
+    assert client.get(f"/video/{saved_as}").content == VIDEO
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_empty_upload_is_rejected(client, analyzer, tmp_path, temp_file_kind):
+    response = upload(client, content=b"")
+
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+    assert analyzer.analyzed == []
+
+
+def test_oversized_upload_is_rejected(client, analyzer, tmp_path, monkeypatch, temp_file_kind):
+    monkeypatch.setattr(main, "MAX_UPLOAD_SIZE", len(VIDEO) - 1)
+
+    response = upload(client)
+
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+    assert analyzer.analyzed == []
+
+
+def test_upload_at_size_limit_is_accepted(client, analyzer, monkeypatch):
+    monkeypatch.setattr(main, "MAX_UPLOAD_SIZE", len(VIDEO))
+
+    assert upload(client).status_code == 200
+
+
+def test_non_video_upload_is_rejected(client, analyzer, tmp_path):
+    response = client.post("/upload", files={"file": ("notes.txt", b"text", "text/plain")})
+
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_identical_reupload_reuses_analysis(client, analyzer):
+    first = upload(client)
+    second = upload(client)
+
+    assert first.status_code == second.status_code == 200
+    assert len(analyzer.analyzed) == 1
+    assert second.json()["key_moments"] == first.json()["key_moments"]
+    assert second.json()["keypoints_file"] == first.json()["keypoints_file"]
+
+
+def test_different_upload_is_analyzed(client, analyzer):
+    upload(client)
+    upload(client, content=VIDEO[::-1])
+
+    assert len(analyzer.analyzed) == 2
+
+
+@pytest.mark.parametrize("artifact", ["keypoints_npz_file", "image"])
+def test_missing_artifact_evicts_cached_analysis(client, analyzer, tmp_path, artifact):
+    result = upload(client).json()
+    name = result["key_moments"][0]["image"] if artifact == "image" else result[artifact]
+    (tmp_path / name).unlink()
+
+    upload(client)
+
+    assert len(analyzer.analyzed) == 2
+    assert (tmp_path / name).exists()
+
+
+def test_pending_image_counts_as_present(client, analyzer, tmp_path, monkeypatch):
+    image = upload(client).json()["key_moments"][0]["image"]
+    (tmp_path / image).unlink()
+    monkeypatch.setitem(video_analyzer_v2._pending_images, image, Future())
+
+    upload(client)
+
+    assert len(analyzer.analyzed) == 1
+
+
+def sse_events(body: bytes):
+    return [block.split(b"\n")[0].removeprefix(b"event: ").decode() for block in body.split(b"\n\n") if block]
+
+
+def test_stream_sends_chunks_then_summary(client, analyzer):
+    response = client.post("/upload/stream", files={"file": ("squat.mp4", VIDEO, "video/mp4")})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert sse_events(response.content) == ["chunk", "chunk", "summary"]
+
+
+def test_cached_stream_sends_only_summary(client, analyzer):
+    upload(client)
+    response = client.post("/upload/stream", files={"file": ("squat.mp4", VIDEO, "video/mp4")})
+
+    assert sse_events(response.content) == ["summary"]
+
+
+def test_disconnected_stream_finishes_analysis(analyzer, tmp_path):
+    class File:
+        filename = "squat.mp4"
+        content_type = "video/mp4"
+
+    video_path = tmp_path / "squat.mp4"
+    video_path.write_bytes(VIDEO)
+    analyzer.proceed.clear()
+
+    async def disconnect_after_first_chunk():
+        stream = main._analysis_event_stream(File(), video_path.name, video_path, len(VIDEO), "digest")
+        assert (await stream.__anext__()).startswith(b"event: chunk")
+        await stream.aclose()
+        # The client is gone but the analysis keeps its slot until it finishes
+        assert main._analysis_semaphore.locked()
+
+        analyzer.proceed.set()
+        await asyncio.wait(set(main._background_analyses))
+
+    asyncio.run(disconnect_after_first_chunk())
+
+    assert not main._analysis_semaphore.locked()
+    assert not main._background_analyses
+    assert main._get_cached_analysis((main.POSE_MODEL_ID, "digest")) is not None
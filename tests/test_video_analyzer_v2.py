@@ -0,0 +1,298 @@
+import io
+import queue
+import threading
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+import app.video_analyzer_v2 as video_analyzer_v2  # noqa: E402
+from app.video_analyzer_v2 import VideoAnalyzer  # noqa: E402
+
+try:
+    import av
+except ImportError:
+    av = None
+
+mp = video_analyzer_v2.mp if video_analyzer_v2.MEDIAPIPE_AVAILABLE else None
+requires_mediapipe = pytest.mark.skipif(mp is None, reason="MediaPipe is not installed")
+requires_av = pytest.mark.skipif(av is None or mp is None, reason="PyAV and MediaPipe are required")
+
+
+@pytest.fixture
+def odd_width_video(tmp_path):
+    """A 1280x720 clip: downscaled to 853x480, whose RGB rows PyAV pads"""
+    path = tmp_path / "clip.mp4"
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 30, (1280, 720))
+    for _ in range(4):
+        writer.write(rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@requires_av
+def test_pyav_frames_reach_mediapipe_unsheared(odd_width_video):
+    analyzer = VideoAnalyzer.__new__(VideoAnalyzer)
+    frames = queue.Queue()
+    with av.open(str(odd_width_video)) as container:
+        analyzer._read_frames_av(container, 2, 4, frames, threading.Event(), {})
+    received = [item for item in iter(frames.get, None)]
+
+    with av.open(str(odd_width_video)) as container:
+        decoded = [
+            frame.to_ndarray(width=853, height=480, format="rgb24", interpolation="AREA")
+            for frame in container.decode(video=0)
+        ][::2]
+
+    assert [frame_count for frame_count, _ in received] == [0, 2]
+    for (_, image), expected in zip(received, decoded):
+        np.testing.assert_array_equal(image.numpy_view(), expected)
+
+
+@requires_mediapipe
+@pytest.mark.parametrize("reader", ["_read_frames", pytest.param("_read_frames_av", marks=requires_av)])
+def test_mediapipe_input_is_contiguous(odd_width_video, monkeypatch, reader):
+    buffers = []
+    make_image = mp.Image
+
+    def image(image_format, data):
+        buffers.append(data)
+        return make_image(image_format, data)
+
+    monkeypatch.setattr(video_analyzer_v2.mp, "Image", image)
+    analyzer = VideoAnalyzer.__new__(VideoAnalyzer)
+    frames = queue.Queue()
+    if reader == "_read_frames":
+        cap = cv2.VideoCapture(str(odd_width_video))
+        analyzer._read_frames(cap, 2, 4, frames, threading.Event(), {})
+        cap.release()
+    else:
+        with av.open(str(odd_width_video)) as container:
+            analyzer._read_frames_av(container, 2, 4, frames, threading.Event(), {})
+
+    assert len(buffers) == 2
+    for data in buffers:
+        assert data.flags.c_contiguous
+        assert data.shape == (480, 853, 3)
+
+
+def _model_bundle() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as bundle:
+        bundle.writestr("pose_detector.tflite", b"detector")
+        bundle.writestr("pose_landmarks_detector.tflite", b"landmarks")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def model_download(monkeypatch):
+    """Serve server.body from the model URL, recording each download in server.downloads"""
+    server = SimpleNamespace(body=_model_bundle(), downloads=[])
+
+    def urlopen(url):
+        server.downloads.append(url)
+        return io.BytesIO(server.body)
+
+    monkeypatch.setattr(video_analyzer_v2.urllib.request, "urlopen", urlopen)
+    monkeypatch.setattr(video_analyzer_v2, "POSE_MODEL_SHA256", "")
+    monkeypatch.setattr(VideoAnalyzer, "_verified", False)
+    return server
+
+
+def test_model_without_hash_is_accepted_if_intact(tmp_path, model_download):
+    model_path = tmp_path / "pose.task"
+    model_path.write_bytes(_model_bundle())
+
+    VideoAnalyzer._ensure_model(None, model_path)
+
+    assert model_download.downloads == []
+
+
+def test_model_without_hash_is_replaced_if_not_a_bundle(tmp_path, model_download):
+    model_path = tmp_path / "pose.task"
+    model_path.write_bytes(b"<html>Service Unavailable</html>")
+
+    VideoAnalyzer._ensure_model(None, model_path)
+
+    assert len(model_download.downloads) == 1
+    assert model_path.read_bytes() == _model_bundle()
+    assert (tmp_path / "pose.task.sha256").exists()
+
+
+def test_downloaded_error_page_is_rejected(tmp_path, model_download):
+    model_download.body = b"<html>Not Found</html>"
+    model_path = tmp_path / "pose.task"
+
+    with pytest.raises(RuntimeError, match="not a valid"):
+        VideoAnalyzer._ensure_model(None, model_path)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def _random_keypoints(frames: int) -> np.ndarray:
+    rng = np.random.default_rng(frames)
+    return rng.random((frames, len(video_analyzer_v2.LANDMARK_NAMES), 4), dtype=np.float32)
+
+
+@pytest.mark.parametrize("kernel", [
+    "_compensation_stats_loop",
+    pytest.param("_compensation_stats_jit", marks=pytest.mark.skipif(
+        not hasattr(video_analyzer_v2, "_compensation_stats_jit"), reason="Numba kernel is not available")),
+])
+@pytest.mark.parametrize("frames", [1, 7, 5000])
+def test_compensation_kernels_match_numpy(kernel, frames):
+    kp = _random_keypoints(frames)
+
+    expected = video_analyzer_v2._compensation_stats_numpy(kp)
+    actual = getattr(video_analyzer_v2, kernel)(kp)
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+def _squat_keypoints(frames: int) -> np.ndarray:
+    """Fully visible, symmetric squat frames: centred hips, equally bent knees"""
+    kp = np.zeros((frames, len(video_analyzer_v2.LANDMARK_NAMES), 4), dtype=np.float32)
+    kp[:, :, video_analyzer_v2.KP_VISIBILITY] = 0.9
+    kp[:, video_analyzer_v2.L_HIP, video_analyzer_v2.KP_X] = 0.45
+    kp[:, video_analyzer_v2.R_HIP, video_analyzer_v2.KP_X] = 0.55
+    kp[:, [video_analyzer_v2.L_KNEE, video_analyzer_v2.R_KNEE], video_analyzer_v2.KP_Y] = 0.6
+    kp[:, [video_analyzer_v2.L_ANKLE, video_analyzer_v2.R_ANKLE], video_analyzer_v2.KP_Y] = 0.9
+    return kp
+
+
+def test_occluded_frames_do_not_feed_compensation_stats():
+    kp = _squat_keypoints(10)
+    # Frames where a leg is out of view report far-off, low-visibility positions
+    occluded = [2, 5, 6]
+    kp[occluded, video_analyzer_v2.R_HIP, video_analyzer_v2.KP_X] = 1.0
+    kp[occluded, video_analyzer_v2.R_ANKLE, video_analyzer_v2.KP_Y] = 0.0
+    kp[occluded, video_analyzer_v2.R_ANKLE, video_analyzer_v2.KP_VISIBILITY] = 0.1
+
+    analysis = VideoAnalyzer.__new__(VideoAnalyzer)._analyze_compensation(kp)
+
+    assert analysis["compensation_detected"] is False
+    assert analysis["metrics"]["max_hip_shift"] == pytest.approx(0.0, abs=1e-6)
+    assert analysis["metrics"]["max_knee_asymmetry"] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_visible_compensation_is_still_detected():
+    kp = _squat_keypoints(10)
+    kp[:, video_analyzer_v2.R_KNEE, video_analyzer_v2.KP_Y] = 0.8
+    kp[0, video_analyzer_v2.L_ANKLE, video_analyzer_v2.KP_VISIBILITY] = 0.1
+
+    analysis = VideoAnalyzer.__new__(VideoAnalyzer)._analyze_compensation(kp)
+
+    assert analysis["compensation_detected"] is True
+    assert analysis["compensating_side"] == "right"
+
+
+def test_fully_occluded_legs_report_no_analysis():
+    kp = _squat_keypoints(10)
+    kp[:, video_analyzer_v2.L_KNEE, video_analyzer_v2.KP_VISIBILITY] = 0.2
+
+    analysis = VideoAnalyzer.__new__(VideoAnalyzer)._analyze_compensation(kp)
+
+    assert analysis == {
+        "compensation_detected": False,
+        "message": "Hips, knees and ankles were not clearly visible in any frame",
+    }
+
+
+class FakeCapture:
+    """cv2.VideoCapture stand-in whose frame n is filled with the value n"""
+
+    def __init__(self):
+        self.position = 0
+        self.reads = []
+        self.frames = []
+
+    def set(self, prop, value):
+        self.position = int(value)
+        return True
+
+    def grab(self):
+        self.position += 1
+        return True
+
+    def read(self):
+        self.reads.append(self.position)
+        frame = np.full((48, 64, 3), self.position, dtype=np.uint8)
+        self.frames.append(frame)
+        self.position += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def key_moment_analyzer(monkeypatch):
+    """An analyzer whose key-moment captures and PNG writes are recorded instead of done"""
+    analyzer = VideoAnalyzer.__new__(VideoAnalyzer)
+    analyzer.captures = []
+    analyzer.saved = {}
+
+    def open_capture(video_path):
+        analyzer.captures.append(FakeCapture())
+        return analyzer.captures[-1]
+
+    monkeypatch.setattr(analyzer, "_open_capture", open_capture)
+    monkeypatch.setattr(video_analyzer_v2, "_save_png_async", lambda path, image: analyzer.saved.update({path.name: image}))
+    return analyzer
+
+
+def _extract(analyzer, frame_numbers, key_frames, duration=2.0):
+    frame_numbers = np.array(frame_numbers, dtype=np.int64)
+    keypoints = _squat_keypoints(len(frame_numbers))
+    return analyzer._extract_key_moments(
+        Path("clip.mp4"), frame_numbers, keypoints, 10.0, duration, 2, {}, key_frames
+    )
+
+
+def test_key_moments_use_frames_kept_by_reader(key_moment_analyzer):
+    # Neutral (0.4s) and peak (1.0s) land on frames 4 and 10
+    key_frames = {4: np.zeros((48, 64, 3), np.uint8), 10: np.zeros((48, 64, 3), np.uint8)}
+
+    moments = _extract(key_moment_analyzer, range(0, 20, 2), key_frames)
+
+    assert [moment["frame"] for moment in moments] == [4, 10]
+    assert key_moment_analyzer.captures == []
+    assert key_moment_analyzer.saved["clip_neutral.png"] is key_frames[4]
+    assert key_moment_analyzer.saved["clip_peak.png"] is key_frames[10]
+
+
+def test_key_moment_without_pose_on_kept_frame_is_read_again(key_moment_analyzer):
+    # No pose on frame 10, so the peak moment moves to frame 8, which the reader did not keep
+    key_frames = {4: np.zeros((48, 64, 3), np.uint8), 10: np.zeros((48, 64, 3), np.uint8)}
+
+    moments = _extract(key_moment_analyzer, [0, 2, 4, 6, 8, 12, 14, 16, 18], key_frames)
+
+    assert [moment["frame"] for moment in moments] == [4, 8]
+    (capture,) = key_moment_analyzer.captures
+    assert capture.reads == [8]
+    assert key_moment_analyzer.saved["clip_neutral.png"] is key_frames[4]
+    assert key_moment_analyzer.saved["clip_peak.png"] is capture.frames[0]
+
+
+@pytest.mark.parametrize("kept", [True, False])
+def test_moments_sharing_a_frame_are_drawn_on_copies(key_moment_analyzer, kept):
+    # A 0.1s clip: both moments land on frame 0
+    key_frames = {0: np.zeros((48, 64, 3), np.uint8)} if kept else {}
+
+    moments = _extract(key_moment_analyzer, [0], key_frames, duration=0.1)
+
+    assert [moment["frame"] for moment in moments] == [0, 0]
+    neutral = key_moment_analyzer.saved["clip_neutral.png"]
+    peak = key_moment_analyzer.saved["clip_peak.png"]
+    assert not np.shares_memory(neutral, peak)
+
+
+def test_key_moments_without_duration_span_sampled_frames(key_moment_analyzer):
+    moments = _extract(key_moment_analyzer, range(0, 20, 2), {}, duration=0)
+
+    assert [moment["frame"] for moment in moments] == [4, 10]